@@ -5,13 +5,133 @@ import os
 
 class Settings(BaseSettings):
     database_url: str = "sqlite:///./stockauth.db"
+    # Defaults to database_url with its asyncio driver (aiosqlite/asyncpg)
+    async_database_url: Optional[str] = None
+    
+    # Connection pool for server databases (Postgres etc.)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle_seconds: int = 1800
+    db_pool_pre_ping: bool = True
+    # Log pool checked-out/overflow counts every N seconds (0 disables)
+    db_pool_log_interval_seconds: float = 0.0
+    
+    # SQLite pragmas applied to every new connection
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size: int = 268435456
+    
     secret_key: str = "your-secret-key-change-this-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    # Where revoked tokens are tracked: "memory" (per worker) or "redis"
+    token_revocation_backend: str = "memory"
+    bcrypt_rounds: int = 12
+    # Rendered TOTP QR codes kept in memory, keyed by (otpauth URI, format)
+    qr_cache_size: int = 256
+    # Pixels per QR module in png/svg codes
+    qr_box_size: int = 10
+    # Current key for stored broker API keys: a Fernet key, or any string
+    # (a key is derived from it). Retired keys stay decryptable while listed
+    # in encryption_keys_previous (comma-separated) until rotate_keys.py has run
     encryption_key: str = "your-32-byte-encryption-key-change-this"
+    encryption_keys_previous: str = ""
+    # Decrypted API keys kept per user in memory (0 disables)
+    api_key_cache_ttl_seconds: float = 300.0
+    api_key_cache_max_entries: int = 1000
     
     # Angel Broker API settings
     angel_api_url: str = "https://apiconnect.angelbroking.com"
+    # Serve broker calls from utils.broker_simulator instead of Angel
+    broker_simulated: bool = True
+    broker_timeout_seconds: float = 10.0
+    broker_connect_timeout_seconds: float = 3.0
+    broker_max_connections: int = 100
+    broker_max_keepalive_connections: int = 20
+    broker_keepalive_expiry_seconds: float = 30.0
+    broker_http2: bool = False  # requires httpx[http2]
+    broker_max_retries: int = 2
+    broker_retry_backoff_seconds: float = 0.2
+    broker_circuit_failure_threshold: int = 5
+    broker_circuit_reset_seconds: float = 30.0
+    # Angel's placeOrder limit per client code; a burst of 1 spaces orders
+    # evenly so no one-second window goes over it (0 disables throttling)
+    broker_orders_per_second: float = 20.0
+    broker_order_burst: float = 1.0
+    basket_max_orders: int = 100
+    
+    # Market-data quotes are shared across users for quote_cache_ttl_seconds;
+    # for quote_cache_stale_seconds after that the old quote is served while
+    # one background call refreshes it (0 disables stale serving)
+    quote_cache_ttl_seconds: float = 1.0
+    quote_cache_stale_seconds: float = 0.0
+    quote_cache_max_entries: int = 5000
+    market_data_batch_max_symbols: int = 500
+    
+    # Order journal group commit: writes per transaction, and how long the
+    # writer waits for more once a write is queued (0 = only batch what
+    # piled up during the previous commit)
+    order_journal_max_batch: int = 200
+    order_journal_max_delay_ms: float = 0.0
+    # Orders whose outcome is UNKNOWN (timeout or cancellation after the
+    # request may have reached the broker), or still SUBMITTING, are looked
+    # up in the broker's order book when their key is retried, once they
+    # are this old
+    order_reconcile_after_seconds: float = 30.0
+    
+    # Portfolios kept in memory for admin aggregates and live revaluation
+    portfolio_book_max_accounts: int = 10000
+    
+    # Broker session store: "memory" (per process) or "redis"
+    session_store_backend: str = "memory"
+    redis_url: str = "redis://localhost:6379"
+    broker_session_ttl_seconds: float = 8 * 60 * 60
+    
+    # Attempt limits for /login, /verify-2fa and /broker-login, per client IP
+    # and per account (a limit of 0 disables that check); "redis" shares the
+    # counters between workers via redis_url
+    rate_limit_backend: str = "memory"
+    rate_limit_max_keys: int = 100000
+    auth_rate_limit_per_ip: int = 30
+    auth_rate_limit_ip_window_seconds: float = 60.0
+    auth_rate_limit_per_account: int = 10
+    auth_rate_limit_account_window_seconds: float = 300.0
+    
+    # Authenticated-principal cache (set either value to 0 to disable)
+    principal_cache_max_entries: int = 10000
+    principal_cache_ttl_seconds: float = 30.0
+    
+    # Bulk admin operations: max rows per request and rows per transaction
+    bulk_max_rows: int = 10000
+    bulk_batch_size: int = 500
+    
+    # Admin dashboard counters; writes through the ORM invalidate sooner
+    stats_cache_ttl_seconds: float = 60.0
+    
+    # Password hashing pool: "thread" or "process" (process runs bcrypt on
+    # several cores); requests beyond max_queue waiting jobs get a 503
+    password_hash_executor: str = "thread"
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 64
+    
+    # Prometheus-format /metrics and the per-request middleware feeding it
+    metrics_enabled: bool = True
+    
+    # Opt-in per-request SQL profiling: logs statements slower than
+    # sql_slow_query_ms and statements run sql_repeat_threshold+ times in one
+    # request (N+1); server_timing adds a Server-Timing header with the
+    # request's DB time and slowest statements (debugging only). Runs on the
+    # metrics middleware, which is then installed even if metrics are off
+    sql_profiler_enabled: bool = False
+    sql_profiler_server_timing: bool = False
+    sql_profiler_top_statements: int = 3
+    sql_slow_query_ms: float = 100.0
+    sql_repeat_threshold: int = 5
+    
+    # Cold-start budget enforced by startup_check.py (import + lifespan + first request)
+    startup_budget_ms: float = 2000.0
     
     class Config:
         env_file = ".env"
@@ -1,18 +1,92 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from config import settings
+from utils.metrics import instrument_engine
+from utils.sql_profiler import sql_profiler
 
-# For SQLite, we need to enable foreign keys and use check_same_thread=False
-if settings.database_url.startswith("sqlite"):
-    engine = create_engine(
-        settings.database_url, 
-        connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(settings.database_url)
+# Asyncio drivers used for the async engine, keyed by the sync backend name
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url() -> str:
+    """Async URL: explicit setting, else database_url with an asyncio driver"""
+    if settings.async_database_url:
+        return settings.async_database_url
+    url = make_url(settings.database_url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver known for {url.drivername}; set ASYNC_DATABASE_URL")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def engine_options(url: str) -> dict:
+    """Keyword arguments for create_engine/create_async_engine"""
+    if url.startswith("sqlite"):
+        # For SQLite, we need to use check_same_thread=False
+        options = {"connect_args": {"check_same_thread": False}}
+        if url.startswith("sqlite+aiosqlite"):
+            # aiosqlite defaults to NullPool, which would reconnect (and
+            # re-run the pragmas) on every request
+            options["poolclass"] = AsyncAdaptedQueuePool
+        return options
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune each new SQLite connection: WAL, busy timeout, sync level, mmap"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def pool_status(engine: Engine) -> dict:
+    """Checked-out/overflow counts for an engine's connection pool"""
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__, "status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        counter = getattr(pool, name, None)
+        if callable(counter):
+            stats[name] = counter()
+    return stats
+
+
+engine = create_engine(settings.database_url, **engine_options(settings.database_url))
+
+async_database_url = get_async_database_url()
+async_engine = create_async_engine(async_database_url, **engine_options(async_database_url))
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragmas)
+if async_engine.dialect.name == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+# Per-request statement counts and DB time for /metrics
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+if settings.sql_profiler_enabled:
+    sql_profiler.install()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
 Base = declarative_base()
 
@@ -22,4 +96,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+In-process HTTP load benchmark for the API
+
+Seeds a throwaway SQLite database with --users accounts, starts the app
+(lifespan included) and drives it over ASGI with concurrent clients, so
+no server, network or real broker is involved (BROKER_SIMULATED is
+forced on). Auth rate limits are turned off; everything else uses the
+current settings, including BCRYPT_ROUNDS.
+
+Scenarios:
+  login_storm       POST /api/auth/login for random accounts
+  users_me          GET /api/users/me polling with existing tokens
+  admin_pagination  GET /api/admin/users cursor pages
+  market_data       GET /api/broker/market-data, many users on few symbols
+  order_burst       POST /api/broker/place-order with idempotency keys
+
+Reports throughput and p50/p95/p99 latency per scenario, optionally
+writes them as JSON, and compares against a baseline written earlier,
+exiting non-zero if a scenario regressed past the thresholds.
+
+    python load_benchmark.py --output results.json
+    python load_benchmark.py --save-baseline bench_baseline.json
+    python load_benchmark.py --baseline bench_baseline.json --max-latency-regression 0.25
+    python load_benchmark.py --scenarios users_me,market_data --scale 0.2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+PASSWORD = "BenchPass123!"
+SYMBOLS = ["2885", "11536", "1594", "3045", "1333"]
+
+# name: (requests, concurrency) at --scale 1
+SCENARIOS = {
+    "login_storm": (200, 32),
+    "users_me": (2000, 64),
+    "admin_pagination": (500, 16),
+    "market_data": (2000, 64),
+    "order_burst": (500, 32),
+}
+
+
+def configure_environment(database_path: str) -> None:
+    """Point the app at the benchmark database; must run before importing it"""
+    url = f"sqlite:///{database_path}"
+    os.environ["DATABASE_URL"] = url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["BROKER_SIMULATED"] = "true"
+    os.environ["AUTH_RATE_LIMIT_PER_IP"] = "0"
+    os.environ["AUTH_RATE_LIMIT_PER_ACCOUNT"] = "0"
+    os.environ["RATE_LIMIT_BACKEND"] = "memory"
+    os.environ["SESSION_STORE_BACKEND"] = "memory"
+    os.environ["TOKEN_REVOCATION_BACKEND"] = "memory"
+
+
+def seed_users(count: int, batch_size: int = 1000):
+    """Insert ``count`` accounts (user 1 is the admin, the rest brokers); returns (id, username) pairs"""
+    from sqlalchemy import insert, select
+
+    from database import SessionLocal, engine
+    from models import Base, User
+    from utils.security import encrypt_data, get_password_hash
+
+    Base.metadata.create_all(bind=engine)
+    # Every account shares one password, so it is hashed (and the API key
+    # encrypted) once rather than per row
+    hashed_password = get_password_hash(PASSWORD)
+    encrypted_api_key = encrypt_data("bench-api-key")
+    with SessionLocal() as db:
+        for start in range(0, count, batch_size):
+            db.execute(insert(User.__table__), [
+                {
+                    "username": f"bench{index:06d}",
+                    "email": f"bench{index:06d}@example.com",
+                    "hashed_password": hashed_password,
+                    "role": "admin" if index == 0 else "broker",
+                    "is_active": True,
+                    "broker_name": "angel",
+                    "encrypted_api_key": encrypted_api_key,
+                }
+                for index in range(start, min(start + batch_size, count))
+            ])
+        db.commit()
+        return db.execute(select(User.id, User.username).order_by(User.id)).all()
+
+
+class Context:
+    """Seeded accounts and their tokens, shared by the scenarios"""
+
+    def __init__(self, users, seed: int):
+        from utils.security import create_access_token
+
+        self.users = users
+        self.seed = seed
+        self.admin_headers = self.headers_for(create_access_token({"sub": users[0].username, "uid": users[0].id}))
+        self.broker_headers = [
+            self.headers_for(create_access_token({"sub": user.username, "uid": user.id})) for user in users[1:]
+        ]
+
+    @staticmethod
+    def headers_for(token: str) -> dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    def rng(self, scenario: str) -> random.Random:
+        # Per scenario, so a run's requests do not depend on which others ran
+        return random.Random(f"{self.seed}:{scenario}")
+
+    async def connect_brokers(self) -> None:
+        from config import settings
+        from utils.session_store import session_store
+
+        for user in self.users[1:]:
+            await session_store.set(user.id, {
+                "client_id": f"B{user.id:06d}",
+                "access_token": f"bench_access_token_{user.id}",
+                "feed_token": f"bench_feed_token_{user.id}",
+            }, settings.broker_session_ttl_seconds)
+
+
+def build_scenario(name: str, ctx: Context, total: int):
+    """Request factory ``(client, i) -> awaitable response`` for a scenario"""
+    rng = ctx.rng(name)
+    brokers = len(ctx.broker_headers)
+
+    if name == "login_storm":
+        picks = [ctx.users[rng.randrange(len(ctx.users))].username for _ in range(total)]
+        return lambda client, i: client.post(
+            "/api/auth/login", data={"username": picks[i], "password": PASSWORD}
+        )
+
+    if name == "users_me":
+        picks = [rng.randrange(brokers) for _ in range(total)]
+        return lambda client, i: client.get("/api/users/me", headers=ctx.broker_headers[picks[i]])
+
+    if name == "admin_pagination":
+        limit = 50
+        cursors = [ctx.users[rng.randrange(len(ctx.users))].id for _ in range(total)]
+        return lambda client, i: client.get(
+            "/api/admin/users", params={"cursor": cursors[i], "limit": limit}, headers=ctx.admin_headers
+        )
+
+    if name == "market_data":
+        picks = [(rng.randrange(brokers), rng.choice(SYMBOLS)) for _ in range(total)]
+        return lambda client, i: client.get(
+            "/api/broker/market-data", params={"symbol": picks[i][1]}, headers=ctx.broker_headers[picks[i][0]]
+        )
+
+    if name == "order_burst":
+        run_id = f"{time.time_ns():x}"
+        picks = [(rng.randrange(brokers), rng.choice(SYMBOLS), rng.randint(1, 20)) for _ in range(total)]
+
+        def place(client, i):
+            broker, symbol, quantity = picks[i]
+            return client.post(
+                "/api/broker/place-order",
+                json={"symbol": symbol, "symbol_token": symbol, "quantity": quantity, "price": 0,
+                      "order_type": "MARKET", "transaction_type": "BUY"},
+                headers={**ctx.broker_headers[broker], "Idempotency-Key": f"bench-{run_id}-{i}"},
+            )
+        return place
+
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def percentile(sorted_values, q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+async def run_scenario(client, make_request, total: int, concurrency: int, warmup: int) -> dict:
+    """Measure requests ``warmup`` .. ``warmup + total - 1`` after running the first ``warmup`` unmeasured"""
+    for i in range(warmup):
+        await make_request(client, i)
+
+    latencies, statuses = [], Counter()
+    indexes = itertools.count(warmup)
+
+    async def worker():
+        for i in indexes:
+            if i >= warmup + total:
+                return
+            started = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def run_benchmark(args, users) -> dict:
+    import httpx
+
+    from main import app
+
+    ctx = Context(users, args.seed)
+    results = {}
+    async with app.router.lifespan_context(app):
+        await ctx.connect_brokers()
+        transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenarios:
+                requests, concurrency = SCENARIOS[name]
+                total = max(int(requests * args.scale), 1)
+                concurrency = args.concurrency or concurrency
+                make_request = build_scenario(name, ctx, args.warmup + total)
+                print(f"{name}: {total} requests, concurrency {concurrency}...", file=sys.stderr)
+                results[name] = await run_scenario(client, make_request, total, concurrency, args.warmup)
+    return results
+
+
+def compare(results: dict, baseline: dict, max_latency_regression: float, max_throughput_regression: float):
+    """Regression messages for scenarios present in both runs"""
+    failures = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if previous[key] and current[key] > previous[key] * (1 + max_latency_regression):
+                failures.append(f"{name} {key} {current[key]:.2f} > baseline {previous[key]:.2f} "
+                                f"+{max_latency_regression:.0%}")
+        if previous["throughput_rps"] and \
+                current["throughput_rps"] < previous["throughput_rps"] * (1 - max_throughput_regression):
+            failures.append(f"{name} throughput {current['throughput_rps']:.1f} < baseline "
+                            f"{previous['throughput_rps']:.1f} -{max_throughput_regression:.0%}")
+        if current["errors"] > previous["errors"]:
+            failures.append(f"{name} errors {current['errors']} > baseline {previous['errors']}")
+    return failures
+
+
+def print_report(results: dict, baseline=None) -> None:
+    print(f"{'scenario':<18} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, result in results["scenarios"].items():
+        print(f"{name:<18} {result['throughput_rps']:9.1f} {result['p50_ms']:9.2f} "
+              f"{result['p95_ms']:9.2f} {result['p99_ms']:9.2f} {result['errors']:7d}")
+        previous = (baseline or {}).get("scenarios", {}).get(name)
+        if previous:
+            print(f"{'  baseline':<18} {previous['throughput_rps']:9.1f} {previous['p50_ms']:9.2f} "
+                  f"{previous['p95_ms']:9.2f} {previous['p99_ms']:9.2f} {previous['errors']:7d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="accounts to seed")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset to run")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every scenario's request count")
+    parser.add_argument("--concurrency", type=int, default=0, help="override every scenario's concurrency")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before each scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="compare against results JSON from an earlier run")
+    parser.add_argument("--save-baseline", help="write results as JSON to use with --baseline later")
+    parser.add_argument("--max-latency-regression", type=float, default=0.25,
+                        help="allowed p50/p95/p99 increase over the baseline (0.25 = 25%%)")
+    parser.add_argument("--max-throughput-regression", type=float, default=0.20,
+                        help="allowed throughput drop below the baseline")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+    if args.users < 2:
+        parser.error("--users must be at least 2 (an admin and a broker)")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="stockauth-bench-") as directory:
+        configure_environment(os.path.join(directory, "bench.db"))
+        started = time.perf_counter()
+        users = seed_users(args.users)
+        print(f"seeded {len(users)} users in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        scenarios = asyncio.run(run_benchmark(args, users))
+
+        from config import settings
+        from database import engine, async_engine
+        engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "users": args.users,
+            "seed": args.seed,
+            "scale": args.scale,
+            "bcrypt_rounds": settings.bcrypt_rounds,
+            "password_hash_executor": settings.password_hash_executor,
+            "password_hash_workers": settings.password_hash_workers,
+        },
+        "scenarios": scenarios,
+    }
+    print_report(results, baseline)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+                f.write("\n")
+
+    if baseline is not None:
+        failures = compare(results, baseline, args.max_latency_regression, args.max_throughput_regression)
+        for failure in failures:
+            print(f"REGRESSION: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,86 @@
-from fastapi import FastAPI
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import logging
 
-from database import engine
+from config import settings
+from database import engine, async_engine, pool_status
 from models import Base
 from routers import auth, users, admin, broker
+from utils.api_key_cache import api_key_cache
+from utils.broker_client import broker_client, BrokerError, BrokerUnavailable
+from utils.metrics import MetricsMiddleware, registry, stats_collector
+from utils.order_journal import order_journal
+from utils.password_pool import password_pool, PasswordPoolSaturated
+from utils.portfolio import portfolio_book
+from utils.principal_cache import principal_cache
+from utils.quote_cache import quote_cache
+from utils.rate_limiter import rate_limiter
+from utils.responses import DefaultJSONResponse
+from utils.session_store import session_store
+from utils.sql_profiler import sql_profiler
+from utils.token_revocation import revocation_list
+
+_imports_done = time.perf_counter()
+logger = logging.getLogger(__name__)
+
+
+async def log_pool_status(interval: float):
+    """Periodically log connection pool usage for sizing workers"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(
+            "db pool sync=%s async=%s",
+            pool_status(engine), pool_status(async_engine.sync_engine)
+        )
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Create tables
     Base.metadata.create_all(bind=engine)
+    await broker_client.start()
+    await order_journal.start()
+    logger.info(
+        "startup: imports %.0f ms, ready %.0f ms after main import began",
+        (_imports_done - _import_started) * 1000, (time.perf_counter() - _import_started) * 1000
+    )
+    pool_logger = None
+    if settings.db_pool_log_interval_seconds > 0:
+        pool_logger = asyncio.create_task(log_pool_status(settings.db_pool_log_interval_seconds))
     yield
+    if pool_logger is not None:
+        pool_logger.cancel()
+        with suppress(asyncio.CancelledError):
+            await pool_logger
+    await order_journal.close()
+    await broker_client.close()
+    password_pool.shutdown()
+    await session_store.close()
+    await rate_limiter.close()
+    await revocation_list.close()
+    await async_engine.dispose()
 
 
 app = FastAPI(
     title="Stock Market Auth API",
     description="Role-based authentication system for stock market applications",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson rendering when it is installed
+    default_response_class=DefaultJSONResponse
 )
 
+# The SQL profiler reads each request's statements from the metrics middleware
+if settings.metrics_enabled or settings.sql_profiler_enabled:
+    app.add_middleware(MetricsMiddleware, profiler=sql_profiler if settings.sql_profiler_enabled else None)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -29,6 +89,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PasswordPoolSaturated)
+async def password_pool_saturated_handler(request: Request, exc: PasswordPoolSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.exception_handler(BrokerUnavailable)
+async def broker_unavailable_handler(request: Request, exc: BrokerUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Broker unavailable: {exc}"},
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.exception_handler(BrokerError)
+async def broker_error_handler(request: Request, exc: BrokerError):
+    return JSONResponse(status_code=502, content={"detail": f"Broker error: {exc}"})
+
+
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
 app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
@@ -42,4 +125,35 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+
+def db_pool_samples():
+    for name, bound in (("sync", engine), ("async", async_engine.sync_engine)):
+        for key, value in pool_status(bound).items():
+            if isinstance(value, int):
+                yield f"db_pool_{key}", f"Connection pool {key}", {"engine": name}, value
+
+
+registry.add_collector(db_pool_samples)
+for prefix, component in (
+    ("principal_cache", principal_cache),
+    ("quote_cache", quote_cache),
+    ("api_key_cache", api_key_cache),
+    ("password_pool", password_pool),
+    ("rate_limiter", rate_limiter),
+    ("token_revocation", revocation_list),
+    ("order_journal", order_journal),
+    ("broker", broker_client),
+    ("portfolio_book", portfolio_book),
+    ("sql_profiler", sql_profiler),
+):
+    registry.add_collector(stats_collector(prefix, component.stats))
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of request, DB, security and component metrics"""
+    if not settings.metrics_enabled:
+        return PlainTextResponse("metrics disabled\n", status_code=404)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
\ No newline at end of file
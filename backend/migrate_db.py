@@ -25,6 +25,26 @@ def migrate_database():
             cursor.execute("ALTER TABLE users ADD COLUMN broker_session_active BOOLEAN DEFAULT 0")
             print("Added broker_session_active column")
         
+        # Indexes backing the admin user list filters and keyset pagination
+        for column in ("role", "is_active", "broker_name", "created_at"):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS ix_users_{column} ON users ({column})")
+        print("Ensured admin filter indexes")
+        
+        # Case-insensitive identity indexes used by login; fails if existing
+        # accounts differ only by case and must be merged by hand first
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email_lower ON users (lower(email))")
+        print("Ensured case-insensitive login indexes")
+        
+        # Broker sessions moved to the session store; drop stale copies
+        cursor.execute(
+            "UPDATE users SET client_id = NULL, pin_number = NULL, access_token = NULL, "
+            "feed_token = NULL, broker_session_active = 0 "
+            "WHERE broker_session_active = 1 OR access_token IS NOT NULL"
+        )
+        if cursor.rowcount:
+            print(f"Cleared legacy broker sessions on {cursor.rowcount} users")
+        
         conn.commit()
         conn.close()
         print("Database migration completed successfully")
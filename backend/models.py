@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Float, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from database import Base
 
@@ -9,14 +9,15 @@ class User(Base):
     username = Column(String(50), unique=True, index=True, nullable=False)
     email = Column(String(100), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
-    role = Column(String(20), default="user", nullable=False)  # user, broker, admin
-    is_active = Column(Boolean, default=True)
+    role = Column(String(20), default="user", nullable=False, index=True)  # user, broker, admin
+    is_active = Column(Boolean, default=True, index=True)
     
     # Broker specific fields
-    broker_name = Column(String(50), default="angel")
+    broker_name = Column(String(50), default="angel", index=True)
     encrypted_api_key = Column(Text)
     
-    # Broker session data (cleared on logout)
+    # Legacy broker session columns, no longer written: sessions now live
+    # in utils.session_store (see migrate_db.py for existing databases)
     client_id = Column(String(100))
     pin_number = Column(String(10))  # Store temporarily for session
     access_token = Column(Text)
@@ -27,5 +28,48 @@ class User(Base):
     totp_secret = Column(String(32))
     is_2fa_enabled = Column(Boolean, default=False)
     
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    # Case-insensitive identity: back the single-query login lookup and
+    # keep "Alice" and "alice" from registering as two accounts
+    __table_args__ = (
+        Index("ix_users_username_lower", func.lower(username), unique=True),
+        Index("ix_users_email_lower", func.lower(email), unique=True),
+    )
+
+
+class Order(Base):
+    """Journal of orders sent to the broker, one row per submission"""
+    __tablename__ = "orders"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Client-chosen key; a resubmission with the same key replays this row
+    idempotency_key = Column(String(64))
+    # SUBMITTING (sent, no answer yet; reconciled like UNKNOWN once stale), PENDING (accepted by the broker),
+    # REJECTED, FAILED (never reached the broker) or UNKNOWN (may have been
+    # placed; reconciled against the broker's order book on retry)
+    status = Column(String(20), nullable=False, default="SUBMITTING")
+    broker_order_id = Column(String(50))
+    error = Column(Text)
+    
+    symbol = Column(String(50), nullable=False)
+    symbol_token = Column(String(20))
+    exchange = Column(String(10), nullable=False)
+    transaction_type = Column(String(10), nullable=False)
+    order_type = Column(String(20), nullable=False)
+    product_type = Column(String(20), nullable=False)
+    variety = Column(String(20), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    price = Column(Float, nullable=False)
+    
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "idempotency_key", name="uq_orders_user_idempotency_key"),
+        # Order-status listing: WHERE user_id = ? AND status = ? ORDER BY id DESC
+        Index("ix_orders_user_status", "user_id", "status", "id"),
+        Index("ix_orders_user_id", "user_id", "id"),
+    )
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Re-encrypt stored broker API keys under the current ENCRYPTION_KEY
+
+Rotation steps:
+  1. Move the old key to ENCRYPTION_KEYS_PREVIOUS and set the new key as
+     ENCRYPTION_KEY; restart the workers (they can decrypt both).
+  2. Run this script, which walks users in id order, a batch at a time,
+     committing each batch so no lock is held for long.
+  3. Remove the old key from ENCRYPTION_KEYS_PREVIOUS once it reports no
+     failures.
+
+    python rotate_keys.py --batch-size 500 --pause-ms 50
+    python rotate_keys.py --dry-run
+"""
+import argparse
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import bindparam, select, update
+
+from database import SessionLocal
+from models import User
+from utils.security import encryption_keys, rotate_data
+
+
+def rotate_batch(db, last_id: int, batch_size: int, current: Fernet, force: bool, dry_run: bool):
+    """Rotate one keyset page; returns (last id seen, rows read, rotated, already current, failed)"""
+    rows = db.execute(
+        select(User.id, User.encrypted_api_key)
+        .where(User.id > last_id, User.encrypted_api_key.is_not(None))
+        .order_by(User.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return last_id, 0, 0, 0, 0
+
+    changes, current_count, failed = [], 0, 0
+    for user_id, token in rows:
+        if not force:
+            try:
+                current.decrypt(token.encode())
+                current_count += 1
+                continue
+            except InvalidToken:
+                pass
+        try:
+            changes.append({"user_id": user_id, "old": token, "new": rotate_data(token)})
+        except InvalidToken:
+            failed += 1
+            print(f"  user {user_id}: not decryptable with any configured key")
+
+    if changes and not dry_run:
+        # Compare-and-set: a key changed by the user meanwhile is left alone
+        db.execute(
+            update(User.__table__)
+            .where(User.id == bindparam("user_id"), User.encrypted_api_key == bindparam("old"))
+            .values(encrypted_api_key=bindparam("new")),
+            changes,
+        )
+        db.commit()
+    else:
+        db.rollback()
+    return rows[-1][0], len(rows), len(changes), current_count, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause-ms", type=float, default=0.0, help="sleep between batches")
+    parser.add_argument("--force", action="store_true", help="also re-encrypt keys already under the current key")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    current = Fernet(encryption_keys()[0])
+    totals = {"read": 0, "rotated": 0, "current": 0, "failed": 0}
+    last_id = 0
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        while True:
+            last_id, read, rotated, already_current, failed = rotate_batch(
+                db, last_id, args.batch_size, current, args.force, args.dry_run
+            )
+            if not read:
+                break
+            totals["read"] += read
+            totals["rotated"] += rotated
+            totals["current"] += already_current
+            totals["failed"] += failed
+            print(f"through user {last_id}: {totals['rotated']} rotated, "
+                  f"{totals['current']} already current, {totals['failed']} failed")
+            if args.pause_ms:
+                time.sleep(args.pause_ms / 1000)
+
+    action = "would rotate" if args.dry_run else "rotated"
+    print(f"Done in {time.perf_counter() - started:.1f}s: {action} {totals['rotated']} of {totals['read']} keys, "
+          f"{totals['current']} already current, {totals['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from anyio.from_thread import run as run_async
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from datetime import datetime, timezone
+import asyncio
+import csv
+import io
+import json
 
-from database import get_db
+from config import settings
+from database import get_db, get_async_db, SessionLocal, engine, async_engine, pool_status
 from models import User
-from schemas import User as UserSchema, UserUpdate
-from routers.auth import get_current_user
+from schemas import (
+    User as UserSchema, UserCreate, UserUpdate, UserRole,
+    BulkAction, BulkUserAction, BulkRowResult, BulkResult, USER_FIELDS
+)
+from routers.auth import get_current_user, get_principal_user, duplicate_field
+from utils.api_key_cache import api_key_cache
+from utils.broker_client import broker_client
+from utils.order_journal import order_journal
+from utils.password_pool import password_pool
+from utils.portfolio import portfolio_book
+from utils.principal_cache import principal_cache
+from utils.quote_cache import quote_cache
+from utils.rate_limiter import rate_limiter
+from utils.responses import json_response, rows_to_dicts
+from utils.security import encrypt_data
+from utils.sql_profiler import sql_profiler
+from utils.stats_cache import get_user_stats, user_stats_cache
+from utils.token_revocation import revocation_list
 
 router = APIRouter()
 
@@ -20,16 +49,363 @@ def require_admin(current_user: User = Depends(get_current_user)):
     return current_user
 
 
+async def require_admin_async(current_user: User = Depends(get_principal_user)):
+    """``require_admin`` for async routes: no sync Session is opened"""
+    return require_admin(current_user)
+
+
+# Columns returned by the user list export, in output order
+EXPORT_COLUMNS = [
+    User.id, User.username, User.email, User.role, User.is_active,
+    User.broker_name, User.is_2fa_enabled, User.created_at,
+]
+EXPORT_BATCH_SIZE = 1000
+USER_COLUMNS = [getattr(User, field) for field in USER_FIELDS]
+
+
+def _stored_datetime(value: Optional[datetime]) -> Optional[datetime]:
+    """``value`` as comparable with stored created_at values: SQLite keeps
+    them as naive UTC text, so an aware bound is converted to that"""
+    if value is None or value.tzinfo is None or engine.dialect.name != "sqlite":
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class UserFilters:
+    """Server-side filters shared by the user list and export endpoints"""
+
+    def __init__(
+        self,
+        role: Optional[UserRole] = None,
+        is_active: Optional[bool] = None,
+        broker_name: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ):
+        self.role = role
+        self.is_active = is_active
+        self.broker_name = broker_name
+        self.created_after = _stored_datetime(created_after)
+        self.created_before = _stored_datetime(created_before)
+
+    def apply(self, stmt):
+        if self.role is not None:
+            stmt = stmt.where(User.role == self.role.value)
+        if self.is_active is not None:
+            stmt = stmt.where(User.is_active == self.is_active)
+        if self.broker_name is not None:
+            stmt = stmt.where(User.broker_name == self.broker_name)
+        if self.created_after is not None:
+            stmt = stmt.where(User.created_at >= self.created_after)
+        if self.created_before is not None:
+            stmt = stmt.where(User.created_at < self.created_before)
+        return stmt
+
+
 @router.get("/users", response_model=List[UserSchema])
 def get_all_users(
-    skip: int = 0,
-    limit: int = 100,
+    cursor: Optional[int] = Query(None, description="Return users with id greater than this (from X-Next-Cursor)"),
+    skip: int = Query(0, description="Deprecated offset paging; ignored when cursor is given"),
+    limit: int = Query(100, ge=1, le=1000),
+    filters: UserFilters = Depends(),
     admin_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
-    """Get all users (admin only)"""
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    """Get all users (admin only)
+
+    Pages are ordered by id. Pass the ``X-Next-Cursor`` response header back
+    as ``cursor`` to fetch the next page with an index seek instead of an
+    OFFSET scan; the header is absent on the last page.
+    """
+    # Column tuples straight to JSON: no ORM identity map, no per-row
+    # response-model validation
+    stmt = filters.apply(select(*USER_COLUMNS)).order_by(User.id)
+    if cursor is not None:
+        stmt = stmt.where(User.id > cursor)
+    elif skip:
+        stmt = stmt.offset(skip)
+    # One row past the page tells whether another page exists
+    rows = db.execute(stmt.limit(limit + 1)).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = str(rows[-1].id)
+    return json_response(rows_to_dicts(USER_FIELDS, rows), headers=headers)
+
+
+def _export_rows(filters: UserFilters):
+    """Yield user rows in id order, fetching EXPORT_BATCH_SIZE at a time"""
+    db = SessionLocal()
+    try:
+        stmt = filters.apply(select(*EXPORT_COLUMNS)).order_by(User.id)
+        result = db.execute(stmt, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+        for partition in result.partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _stream_ndjson(filters: UserFilters):
+    keys = [column.key for column in EXPORT_COLUMNS]
+    for partition in _export_rows(filters):
+        yield "".join(
+            json.dumps(dict(zip(keys, map(_export_value, row)))) + "\n" for row in partition
+        )
+
+
+def _stream_csv(filters: UserFilters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.key for column in EXPORT_COLUMNS])
+    for partition in _export_rows(filters):
+        writer.writerows([_export_value(value) for value in row] for row in partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@router.get("/users/export")
+def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    filters: UserFilters = Depends(),
+    admin_user: User = Depends(require_admin)
+):
+    """Stream all matching users as NDJSON or CSV (admin only)"""
+    if format == "csv":
+        return StreamingResponse(
+            _stream_csv(filters),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="users.csv"'},
+        )
+    return StreamingResponse(_stream_ndjson(filters), media_type="application/x-ndjson")
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _bulk_result(results: List[BulkRowResult]) -> BulkResult:
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.status == "error")
+    return BulkResult(succeeded=len(results) - failed, failed=failed, results=results)
+
+
+async def _find_taken(db: AsyncSession, usernames: List[str], emails: List[str]):
+    """Lowercased usernames and emails that already exist, one set-based
+    query per chunk (matches the case-insensitive unique indexes)"""
+    taken_usernames, taken_emails = set(), set()
+    for names, mails in zip(
+        _chunks(usernames, settings.bulk_batch_size), _chunks(emails, settings.bulk_batch_size)
+    ):
+        rows = await db.execute(
+            select(User.username, User.email).where(
+                or_(func.lower(User.username).in_(names), func.lower(User.email).in_(mails))
+            )
+        )
+        for username, email in rows:
+            taken_usernames.add(username.lower())
+            taken_emails.add(email.lower())
+    return taken_usernames, taken_emails
+
+
+async def _insert_batch(db: AsyncSession, batch: List[tuple]) -> List[BulkRowResult]:
+    """Insert one batch in a single transaction, falling back to row by row
+    if a concurrent writer makes it violate a unique constraint"""
+    stmt = insert(User).returning(User.id, User.username)
+    try:
+        result = await db.execute(stmt, [row for _, row in batch])
+        created = {username: user_id for user_id, username in result}
+        await db.commit()
+        return [
+            BulkRowResult(index=index, status="created", id=created[row["username"]], username=row["username"])
+            for index, row in batch
+        ]
+    except IntegrityError:
+        await db.rollback()
+    results = []
+    for index, row in batch:
+        try:
+            user_id = (await db.execute(stmt, row)).scalar_one()
+            await db.commit()
+            results.append(BulkRowResult(index=index, status="created", id=user_id, username=row["username"]))
+        except IntegrityError:
+            await db.rollback()
+            results.append(BulkRowResult(
+                index=index, status="error", username=row["username"],
+                error="Username or email already registered"
+            ))
+    return results
+
+
+def _encrypt_all(values: List[str]) -> List[str]:
+    return [encrypt_data(value) for value in values]
+
+
+async def bulk_create_users(db: AsyncSession, rows: List[tuple]) -> BulkResult:
+    """Create users from ``(index, UserCreate)`` pairs, reporting per row"""
+    results: List[BulkRowResult] = []
+    seen_usernames, seen_emails = set(), set()
+    candidates = []
+    for index, user in rows:
+        username, email = user.username.lower(), user.email.lower()
+        if username in seen_usernames or email in seen_emails:
+            results.append(BulkRowResult(
+                index=index, status="error", username=user.username,
+                error="Duplicate username or email within upload"
+            ))
+            continue
+        seen_usernames.add(username)
+        seen_emails.add(email)
+        candidates.append((index, user))
+    
+    taken_usernames, taken_emails = await _find_taken(
+        db, [user.username.lower() for _, user in candidates], [user.email.lower() for _, user in candidates]
+    )
+    accepted = []
+    for index, user in candidates:
+        if user.username.lower() in taken_usernames:
+            results.append(BulkRowResult(index=index, status="error", username=user.username,
+                                         error="Username already registered"))
+        elif user.email.lower() in taken_emails:
+            results.append(BulkRowResult(index=index, status="error", username=user.username,
+                                         error="Email already registered"))
+        else:
+            accepted.append((index, user))
+    
+    # Both off the event loop: bcrypt in the password pool, Fernet (cheap
+    # per row, but up to bulk_max_rows of them) in a worker thread
+    hashed_passwords, encrypted_api_keys = await asyncio.gather(
+        password_pool.hash_many([user.password for _, user in accepted]),
+        run_in_threadpool(_encrypt_all, [user.api_key for _, user in accepted]),
+    )
+    prepared = [
+        (index, {
+            "username": user.username,
+            "email": user.email,
+            "hashed_password": hashed_password,
+            "role": user.role.value,
+            "broker_name": user.broker_name,
+            "encrypted_api_key": encrypted_api_key,
+        })
+        for (index, user), hashed_password, encrypted_api_key in zip(accepted, hashed_passwords, encrypted_api_keys)
+    ]
+    for batch in _chunks(prepared, settings.bulk_batch_size):
+        results.extend(await _insert_batch(db, batch))
+    # Bulk inserts bypass the ORM flush hooks that maintain the counters
+    user_stats_cache.invalidate()
+    return _bulk_result(results)
+
+
+def _check_bulk_size(count: int):
+    if count > settings.bulk_max_rows:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.bulk_max_rows} rows per request"
+        )
+
+
+@router.post("/users/bulk", response_model=BulkResult)
+async def bulk_create_users_json(
+    users: List[UserCreate],
+    admin_user: User = Depends(require_admin_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Create many users from a JSON array (admin only)"""
+    _check_bulk_size(len(users))
+    return await bulk_create_users(db, list(enumerate(users)))
+
+
+@router.post("/users/bulk/csv", response_model=BulkResult)
+async def bulk_create_users_csv(
+    file: UploadFile = File(...),
+    admin_user: User = Depends(require_admin_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Create many users from a CSV upload (admin only)
+
+    Columns: username, email, password, role, broker_name, api_key. Row
+    indexes in the result count data rows from 0, excluding the header.
+    """
+    text = (await file.read()).decode("utf-8-sig")
+    rows, invalid = [], []
+    for index, record in enumerate(csv.DictReader(io.StringIO(text))):
+        record = {key: value for key, value in record.items() if key and value not in (None, "")}
+        record.setdefault("api_key", "")
+        try:
+            rows.append((index, UserCreate(**record)))
+        except ValidationError as exc:
+            invalid.append(BulkRowResult(
+                index=index, status="error", username=record.get("username"),
+                error="; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+            ))
+    _check_bulk_size(len(rows) + len(invalid))
+    result = await bulk_create_users(db, rows)
+    return _bulk_result(result.results + invalid)
+
+
+@router.post("/users/bulk-action", response_model=BulkResult)
+def bulk_user_action(
+    bulk_action: BulkUserAction,
+    admin_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """Activate, deactivate, delete or change the role of many users (admin only)"""
+    _check_bulk_size(len(bulk_action.user_ids))
+    if bulk_action.action == BulkAction.SET_ROLE and bulk_action.role is None:
+        raise HTTPException(status_code=400, detail="role is required for set_role")
+    
+    user_ids = list(dict.fromkeys(bulk_action.user_ids))
+    roles = {}
+    for chunk in _chunks(user_ids, settings.bulk_batch_size):
+        roles.update(db.execute(select(User.id, User.role).where(User.id.in_(chunk))).all())
+    
+    results, targets = [], []
+    for index, user_id in enumerate(user_ids):
+        if user_id not in roles:
+            results.append(BulkRowResult(index=index, status="error", id=user_id, error="User not found"))
+        elif bulk_action.action == BulkAction.DELETE and roles[user_id] == "admin":
+            results.append(BulkRowResult(index=index, status="error", id=user_id, error="Cannot delete admin user"))
+        else:
+            targets.append((index, user_id))
+    
+    if bulk_action.action == BulkAction.DELETE:
+        status_label = "deleted"
+    else:
+        status_label = "updated"
+        values = {
+            BulkAction.ACTIVATE: {"is_active": True},
+            BulkAction.DEACTIVATE: {"is_active": False},
+            BulkAction.SET_ROLE: {"role": bulk_action.role.value if bulk_action.role else None},
+        }[bulk_action.action]
+    
+    for batch in _chunks(targets, settings.bulk_batch_size):
+        ids = [user_id for _, user_id in batch]
+        if bulk_action.action == BulkAction.DELETE:
+            db.execute(delete(User).where(User.id.in_(ids)), execution_options={"synchronize_session": False})
+        else:
+            db.execute(update(User).where(User.id.in_(ids)).values(**values), execution_options={"synchronize_session": False})
+        db.commit()
+        if bulk_action.action in (BulkAction.DELETE, BulkAction.DEACTIVATE):
+            run_async(revocation_list.revoke_users, ids)
+        elif bulk_action.action == BulkAction.ACTIVATE:
+            run_async(revocation_list.restore_users, ids)
+        for index, user_id in batch:
+            principal_cache.invalidate_user(user_id)
+            if bulk_action.action == BulkAction.DELETE:
+                portfolio_book.discard(user_id)
+                api_key_cache.invalidate_user(user_id)
+            results.append(BulkRowResult(index=index, status=status_label, id=user_id))
+    
+    user_stats_cache.invalidate()
+    return _bulk_result(results)
 
 
 @router.get("/users/{user_id}", response_model=UserSchema)
@@ -66,7 +442,17 @@ def update_user(
     if user_update.broker_name is not None:
         user.broker_name = user_update.broker_name
     
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        field = duplicate_field(exc)
+        raise HTTPException(status_code=400, detail=f"{field.capitalize()} already taken")
+    if user_update.is_active is False:
+        run_async(revocation_list.revoke_user, user.id)
+    elif user_update.is_active:
+        run_async(revocation_list.restore_users, [user.id])
+    principal_cache.invalidate_user(user.id)
     db.refresh(user)
     return user
 
@@ -87,25 +473,90 @@ def delete_user(
     
     db.delete(user)
     db.commit()
+    run_async(revocation_list.revoke_user, user_id)
+    principal_cache.invalidate_user(user_id)
+    portfolio_book.discard(user_id)
+    api_key_cache.invalidate_user(user_id)
     return {"message": "User deleted successfully"}
 
 
 @router.get("/stats")
 def get_admin_stats(
+    refresh: bool = Query(False, description="Bypass the counter cache and recount"),
     admin_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
     """Get admin dashboard statistics"""
-    total_users = db.query(User).count()
-    active_users = db.query(User).filter(User.is_active == True).count()
-    admin_users = db.query(User).filter(User.role == "admin").count()
-    broker_users = db.query(User).filter(User.role == "broker").count()
-    regular_users = db.query(User).filter(User.role == "user").count()
-    
+    return get_user_stats(db, refresh=refresh)
+
+
+@router.get("/portfolios/summary")
+def get_portfolio_summary(
+    top: int = Query(20, ge=0, le=500, description="Largest per-symbol exposures to list"),
+    admin_user: User = Depends(require_admin)
+):
+    """Aggregate value and P&L across the portfolios held in memory (admin only)"""
+    return {**portfolio_book.summary(top=top), "book": portfolio_book.stats()}
+
+
+@router.get("/cache-stats")
+def get_cache_stats(admin_user: User = Depends(require_admin)):
+    """Get authenticated-principal cache counters (admin only)"""
+    return principal_cache.stats()
+
+
+@router.get("/api-key-cache-stats")
+def get_api_key_cache_stats(admin_user: User = Depends(require_admin)):
+    """Get decrypted API key cache counters (admin only)"""
+    return api_key_cache.stats()
+
+
+@router.get("/quote-cache-stats")
+def get_quote_cache_stats(admin_user: User = Depends(require_admin)):
+    """Get market-data quote cache hit/miss/coalescing counters (admin only)"""
+    return quote_cache.stats()
+
+
+@router.get("/rate-limit-stats")
+def get_rate_limit_stats(admin_user: User = Depends(require_admin)):
+    """Get login/TOTP rate limiter counters (admin only)"""
+    return rate_limiter.stats()
+
+
+@router.get("/revocation-stats")
+def get_revocation_stats(admin_user: User = Depends(require_admin)):
+    """Get revoked token and user counts (admin only)"""
+    return revocation_list.stats()
+
+
+@router.get("/password-pool-stats")
+def get_password_pool_stats(admin_user: User = Depends(require_admin)):
+    """Get password hashing pool queue depth and counters (admin only)"""
+    return password_pool.stats()
+
+
+@router.get("/broker-stats")
+def get_broker_stats(admin_user: User = Depends(require_admin)):
+    """Get broker circuit breaker and order throttle state (admin only)"""
+    return broker_client.stats()
+
+
+@router.get("/order-journal-stats")
+def get_order_journal_stats(admin_user: User = Depends(require_admin)):
+    """Get order journal group-commit counters (admin only)"""
+    return order_journal.stats()
+
+
+@router.get("/sql-profiler-stats")
+def get_sql_profiler_stats(admin_user: User = Depends(require_admin)):
+    """Get SQL profiler slow and repeated statement counts (admin only)"""
+    return {"enabled": settings.sql_profiler_enabled, **sql_profiler.stats()}
+
+
+@router.get("/db-pool")
+def get_db_pool_status(admin_user: User = Depends(require_admin)):
+    """Get connection pool checked-out and overflow counts (admin only)"""
     return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "admin_users": admin_users,
-        "broker_users": broker_users,
-        "regular_users": regular_users
-    }
\ No newline at end of file
+        "sync": pool_status(engine),
+        "async": pool_status(async_engine.sync_engine),
+    }
@@ -1,15 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
-from database import get_db
+from database import get_db, get_async_db
 from models import User
-from schemas import UserCreate, User as UserSchema, Token, BrokerLogin, TOTPSetup, TOTPVerify
+from schemas import UserCreate, User as UserSchema, Token, BrokerLogin, TOTPSetup, TOTPVerify, QRFormat
 from utils.security import (
-    verify_password, get_password_hash, create_access_token, 
-    encrypt_data, generate_totp_secret, generate_qr_code, verify_totp
+    create_access_token, encrypt_data, generate_totp_secret, generate_qr_code, verify_totp
 )
+from utils.api_key_cache import api_key_cache
+from utils.password_pool import password_pool
+from utils.portfolio import portfolio_book
+from utils.principal_cache import principal_cache
+from utils.rate_limiter import rate_limiter, retry_after_header
+from utils.session_store import session_store
+from utils.token_revocation import revocation_list
 from config import settings
 
 router = APIRouter()
@@ -17,52 +28,195 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def get_user_by_username_async(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username).limit(1))
+    return result.scalars().first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+def snapshot_user(user: User) -> dict:
+    """Copy the column values of a user row into a plain dict"""
+    return {column.key: getattr(user, column.key) for column in User.__table__.columns}
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
-    if not user:
-        user = get_user_by_email(db, username)
+def detached_user(snapshot: dict) -> User:
+    """Rebuild a User from a snapshot, bound to no session (reads only)"""
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
+def attach_user(db: Session, snapshot: dict) -> User:
+    """Rebuild a persistent User in ``db`` from a snapshot without a SELECT"""
+    return db.merge(detached_user(snapshot), load=False)
+
+async def get_user_by_login_async(db: AsyncSession, identifier: str):
+    """Find a user by username or email, case-insensitively, in one query.
+
+    Served by the lower(username)/lower(email) indexes; a username match
+    wins over an email match, as with the old two-step lookup.
+    """
+    identifier = identifier.lower()
+    username_match = func.lower(User.username) == identifier
+    result = await db.execute(
+        select(User)
+        .where(or_(username_match, func.lower(User.email) == identifier))
+        .order_by(case((username_match, 0), else_=1))
+        .limit(1)
+    )
+    return result.scalars().first()
+
+async def get_taken_field_async(db: AsyncSession, username: str, email: str):
+    """"username" or "email" if either is already registered (case-insensitively), else None
+
+    One query served by the lower(username)/lower(email) indexes.
+    """
+    username_match = func.lower(User.username) == username.lower()
+    result = await db.execute(
+        select(username_match)
+        .where(or_(username_match, func.lower(User.email) == email.lower()))
+        .order_by(case((username_match, 0), else_=1))
+        .limit(1)
+    )
+    row = result.first()
+    if row is None:
+        return None
+    return "username" if row[0] else "email"
+
+def duplicate_field(exc: IntegrityError) -> str:
+    """Which identity column a unique-constraint violation was about"""
+    message = str(exc.orig)
+    if "users.email" in message or "ix_users_email" in message:
+        return "email"
+    return "username"
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_login_async(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await password_pool.verify_and_update(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # Stored hash uses an outdated bcrypt cost; upgrade it in place
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    from utils.security import verify_token
+def get_token_claims(token: str = Depends(oauth2_scheme)) -> dict:
+    """Claims of the bearer token; 401 if it is invalid or expired"""
+    from utils.security import decode_token
+    claims = decode_token(token)
+    if claims is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return claims
+
+
+def issued_before(claims: dict, created_at: Optional[datetime]) -> bool:
+    """Whether the token predates the account (compared in whole seconds, like iat)"""
+    if created_at is None:
+        return False
+    if created_at.tzinfo is None:
+        # SQLite returns CURRENT_TIMESTAMP values without a zone; they are UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return claims.get("iat", 0) < int(created_at.timestamp())
+
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    claims: dict = Depends(get_token_claims),
+    async_db: AsyncSession = Depends(get_async_db)
+) -> dict:
+    """Resolve the bearer token to a snapshot of the user's row.
+
+    The lookup never blocks the event loop: it is served from the principal
+    cache or the async engine. Read-only routes can use the snapshot as-is;
+    ``get_current_user`` turns it into an ORM User.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    username = verify_token(token)
-    if username is None:
+    username = claims["sub"]
+    snapshot = principal_cache.get(token)
+    if snapshot is None or snapshot["username"] != username:
+        user = await get_user_by_username_async(async_db, username=username)
+        if user is None:
+            raise credentials_exception
+        snapshot = snapshot_user(user)
+        principal_cache.set(token, snapshot)
+    
+    # A token issued to a deleted account whose username was taken again;
+    # the iat check covers databases that reuse the deleted row's id
+    if claims.get("uid") != snapshot["id"] or issued_before(claims, snapshot["created_at"]):
         raise credentials_exception
-        
-    user = get_user_by_username(db, username=username)
-    if user is None:
+    # Deactivation also applies on workers whose (per-process) revocation
+    # list never heard of it, once their cached snapshot is refreshed
+    if not snapshot["is_active"]:
         raise credentials_exception
-    return user
+    # Checked on cache hits too, so logout and deactivation apply at once
+    if await revocation_list.is_revoked(claims.get("jti"), snapshot["id"], claims.get("iat")):
+        raise credentials_exception
+    return snapshot
+
+
+async def get_current_user(
+    snapshot: dict = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    """The authenticated User, attached to the request's sync session without
+    I/O so sync routes can modify and commit it as before"""
+    return attach_user(db, snapshot)
+
+
+async def get_principal_user(snapshot: dict = Depends(get_current_principal)) -> User:
+    """The authenticated User for async routes: read-only and detached, so
+    no sync Session (and threadpool hop) is opened for the request"""
+    return detached_user(snapshot)
+
+
+async def enforce_rate_limits(scope: str, request: Request, account: str):
+    """429 once the client IP, then the account, is over its attempt budget"""
+    checks = (
+        (f"{scope}:ip:{request.client.host if request.client else 'unknown'}",
+         settings.auth_rate_limit_per_ip, settings.auth_rate_limit_ip_window_seconds),
+        (f"{scope}:account:{account}",
+         settings.auth_rate_limit_per_account, settings.auth_rate_limit_account_window_seconds),
+    )
+    for key, limit, window in checks:
+        if limit <= 0:
+            continue
+        allowed, retry_after = await rate_limiter.hit(key, limit, window)
+        if not allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, please try again later",
+                headers={"Retry-After": retry_after_header(retry_after)},
+            )
+
+
+async def login_rate_limit(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    """Runs before the password check, so rejected attempts cost no bcrypt work"""
+    await enforce_rate_limits("login", request, form_data.username.lower())
+
+
+async def totp_rate_limit(request: Request, current_user: User = Depends(get_principal_user)):
+    # One budget for every TOTP check, so attempts cannot be split across routes
+    await enforce_rate_limits("totp", request, str(current_user.id))
 
 @router.post("/register", response_model=UserSchema)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    # Check if user exists
-    db_user = get_user_by_username(db, username=user.username)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    db_user = get_user_by_email(db, email=user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create new user
-    hashed_password = get_password_hash(user.password)
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    # Reject taken usernames/emails before paying for a bcrypt hash; the
+    # unique indexes still catch a concurrent registration on commit
+    taken = await get_taken_field_async(db, user.username, user.email)
+    if taken is not None:
+        raise HTTPException(status_code=400, detail=f"{taken.capitalize()} already registered")
+    # Return the connection to the pool while the hash runs
+    await db.rollback()
+    
+    hashed_password = await password_pool.hash(user.password)
     encrypted_api_key = encrypt_data(user.api_key)
     
     db_user = User(
@@ -74,14 +228,19 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         encrypted_api_key=encrypted_api_key
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        await db.commit()
+    except IntegrityError as exc:
+        await db.rollback()
+        field = duplicate_field(exc)
+        raise HTTPException(status_code=400, detail=f"{field.capitalize()} already registered")
+    await db.refresh(db_user)
     
     return db_user
 
-@router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+@router.post("/login", response_model=Token, dependencies=[Depends(login_rate_limit)])
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -98,7 +257,9 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        # uid pins the token to this account: a later account that reuses
+        # the username (after a deletion) does not inherit it
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     return {
         "access_token": access_token, 
@@ -108,22 +269,33 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 
 @router.post("/setup-2fa", response_model=TOTPSetup)
-def setup_2fa(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def setup_2fa(
+    qr_format: QRFormat = QRFormat.PNG,
+    current_user: User = Depends(get_principal_user),
+    db: AsyncSession = Depends(get_async_db)
+):
     """Setup 2FA for the current user"""
     if current_user.is_2fa_enabled:
         raise HTTPException(status_code=400, detail="2FA is already enabled")
     
-    secret = generate_totp_secret()
-    qr_code = generate_qr_code(current_user.username, secret)
+    # Reuse a pending (not yet verified) secret so repeated setup calls hit
+    # the QR cache instead of re-rendering and rewriting the row
+    secret = current_user.totp_secret
+    if not secret:
+        secret = generate_totp_secret()
+        # Store the secret temporarily (user needs to verify before enabling)
+        await db.execute(update(User).where(User.id == current_user.id).values(totp_secret=secret))
+        await db.commit()
+        principal_cache.invalidate_user(current_user.id)
     
-    # Store the secret temporarily (user needs to verify before enabling)
-    current_user.totp_secret = secret
-    db.commit()
+    qr_code = await run_in_threadpool(
+        generate_qr_code, current_user.username, secret, qr_format.value
+    )
     
-    return {"secret": secret, "qr_code": qr_code}
+    return {"secret": secret, "qr_code": qr_code, "qr_format": qr_format}
 
 
-@router.post("/verify-2fa")
+@router.post("/verify-2fa", dependencies=[Depends(totp_rate_limit)])
 def verify_2fa(
     totp_data: TOTPVerify, 
     current_user: User = Depends(get_current_user), 
@@ -138,6 +310,7 @@ def verify_2fa(
     
     current_user.is_2fa_enabled = True
     db.commit()
+    principal_cache.invalidate_user(current_user.id)
     
     return {"message": "2FA enabled successfully"}
 
@@ -159,11 +332,10 @@ def debug_2fa(current_user: User = Depends(get_current_user)):
     }
 
 
-@router.post("/broker-login")
-def broker_login(
+@router.post("/broker-login", dependencies=[Depends(totp_rate_limit)])
+async def broker_login(
     broker_data: BrokerLogin,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_principal_user)
 ):
     """Handle broker login with Client ID, PIN, TOTP and API Key from database"""
     
@@ -182,16 +354,11 @@ def broker_login(
         raise HTTPException(status_code=400, detail="Invalid 2FA token")
     
     # Decrypt API key for broker authentication
-    from utils.security import decrypt_data
     try:
-        api_key = decrypt_data(current_user.encrypted_api_key)
+        api_key = api_key_cache.get(current_user.id, current_user.encrypted_api_key)
     except Exception:
         raise HTTPException(status_code=400, detail="Failed to decrypt API key")
     
-    # Store broker session data
-    current_user.client_id = broker_data.client_id
-    current_user.pin_number = broker_data.pin  # Store temporarily for session
-    
     # Simulate Angel Broker API authentication
     # In real implementation, you would call Angel Broker API with:
     # - client_id, pin, totp_token, api_key
@@ -201,38 +368,37 @@ def broker_login(
     import hashlib
     
     # Generate simulated tokens (in real app, these come from Angel Broker)
-    session_id = hashlib.md5(f"{current_user.client_id}{time.time()}".encode()).hexdigest()
-    current_user.access_token = f"angel_access_token_{session_id}"
-    current_user.feed_token = f"angel_feed_token_{session_id}"
-    current_user.broker_session_active = True
+    session_id = hashlib.md5(f"{broker_data.client_id}{time.time()}".encode()).hexdigest()
+    broker_session = {
+        "client_id": broker_data.client_id,
+        "access_token": f"angel_access_token_{session_id}",
+        "feed_token": f"angel_feed_token_{session_id}",
+    }
     
-    db.commit()
+    # Broker sessions live in the session store (with TTL), not on the users row
+    await session_store.set(current_user.id, broker_session, settings.broker_session_ttl_seconds)
     
     return {
         "message": "Broker authentication successful",
-        "access_token": current_user.access_token,
-        "feed_token": current_user.feed_token,
-        "client_id": current_user.client_id,
+        **broker_session,
         "broker_session_active": True
     }
 
 
 @router.post("/logout")
-def logout_user(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def logout_user(
+    current_user: User = Depends(get_principal_user),
+    claims: dict = Depends(get_token_claims)
 ):
-    """Logout user and clear all broker session data"""
+    """Logout user, revoke the token used and clear all broker session data"""
     
-    # Clear all broker session data
-    current_user.client_id = None
-    current_user.pin_number = None
-    current_user.access_token = None
-    current_user.feed_token = None
-    current_user.broker_session_active = False
+    if claims.get("jti"):
+        await revocation_list.revoke(claims["jti"], claims["exp"])
     
-    db.commit()
+    # Clear all broker session data
+    await session_store.delete(current_user.id)
+    portfolio_book.discard(current_user.id)
     
     return {
         "message": "Logged out successfully. All broker session data cleared."
-    }
\ No newline at end of file
+    }
@@ -1,18 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-import httpx
-from typing import Dict, Any
-
-from database import get_db
-from models import User
-from routers.auth import get_current_user
-from utils.security import decrypt_data
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+import asyncio
+import json
+import logging
+
+from database import AsyncSessionLocal, get_async_db
+from models import Order, User
+from schemas import BasketOrder, MarketDataBatch, OrderCreate, OrderRecord, OrderResult
+from routers.auth import get_principal_user
+from utils.api_key_cache import api_key_cache
+from utils.broker_client import BrokerError, BrokerUnavailable, broker_client
+from utils.order_journal import order_journal
+from utils.portfolio import Portfolio, portfolio_book, quote_prices
+from utils.quote_cache import quote_cache
+from utils.session_store import session_store
 from config import settings
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Basket legs still running, kept referenced until they finish
+_basket_legs = set()
+
+IST = timezone(timedelta(hours=5, minutes=30))
 
 
-def require_broker_or_admin(current_user: User = Depends(get_current_user)):
+async def require_broker_or_admin(current_user: User = Depends(get_principal_user)):
     """Dependency to require broker or admin role - allow users with broker access"""
     if current_user.role not in ["broker", "admin", "user"]:
         raise HTTPException(
@@ -22,10 +40,15 @@ def require_broker_or_admin(current_user: User = Depends(get_current_user)):
     return current_user
 
 
+async def get_broker_session(current_user: User = Depends(require_broker_or_admin)) -> dict:
+    """Current user's broker session from the session store ({} if none)"""
+    return await session_store.get(current_user.id) or {}
+
+
 @router.get("/profile")
-def get_broker_profile(
+async def get_broker_profile(
     current_user: User = Depends(require_broker_or_admin),
-    db: Session = Depends(get_db)
+    broker_session: dict = Depends(get_broker_session)
 ):
     """Get broker profile with decrypted API key"""
     profile = {
@@ -34,126 +57,491 @@ def get_broker_profile(
         "email": current_user.email,
         "role": current_user.role,
         "broker_name": current_user.broker_name,
-        "client_id": current_user.client_id,
+        "client_id": broker_session.get("client_id"),
         "has_api_key": bool(current_user.encrypted_api_key),
-        "has_access_token": bool(current_user.access_token),
-        "has_feed_token": bool(current_user.feed_token),
+        "has_access_token": bool(broker_session.get("access_token")),
+        "has_feed_token": bool(broker_session.get("feed_token")),
         "is_2fa_enabled": current_user.is_2fa_enabled,
-        "broker_session_active": current_user.broker_session_active or False
+        "broker_session_active": bool(broker_session)
     }
     return profile
 
 
+def get_api_key(current_user: User) -> str:
+    """Decrypt the user's stored Angel API key"""
+    if not current_user.encrypted_api_key:
+        raise HTTPException(status_code=400, detail="API key not configured")
+    try:
+        return api_key_cache.get(current_user.id, current_user.encrypted_api_key)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Failed to decrypt API key")
+
+
+def shared_quote_error(exc: Exception) -> bool:
+    """Whether a coalesced quote fetch's error holds for every caller.
+
+    The fetch runs with the first caller's broker session and API key, so
+    only transport failures are shared; anything else (an expired session,
+    say) is retried by the other callers with their own credentials.
+    """
+    return isinstance(exc, BrokerUnavailable)
+
+
+def parse_feed_time(value: Optional[str]) -> Optional[str]:
+    """Angel's exchFeedTime (IST, e.g. 15-Jan-2024 15:30:00) as ISO 8601"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value, "%d-%b-%Y %H:%M:%S")
+    except ValueError:
+        return value
+    return parsed.replace(tzinfo=IST).isoformat()
+
+
+def quote_to_market_data(symbol: str, quote: dict) -> dict:
+    return {
+        "symbol": symbol,
+        "price": quote.get("ltp"),
+        "change": quote.get("netChange"),
+        "change_percent": quote.get("percentChange"),
+        "volume": quote.get("tradeVolume"),
+        "high": quote.get("high"),
+        "low": quote.get("low"),
+        "open": quote.get("open"),
+        "timestamp": parse_feed_time(quote.get("exchFeedTime"))
+    }
+
+
 @router.post("/connect")
 async def connect_to_broker(
     current_user: User = Depends(require_broker_or_admin),
-    db: Session = Depends(get_db)
+    broker_session: dict = Depends(get_broker_session)
 ):
     """Connect to Angel Broker API"""
-    if not current_user.encrypted_api_key:
-        raise HTTPException(status_code=400, detail="API key not configured")
+    api_key = get_api_key(current_user)
     
-    if not current_user.client_id:
+    if not broker_session.get("client_id"):
         raise HTTPException(status_code=400, detail="Client ID not configured")
     
-    try:
-        # Decrypt API key
-        api_key = decrypt_data(current_user.encrypted_api_key)
-        
-        # In a real implementation, you would make actual API calls to Angel Broker
-        # For now, we'll simulate the connection
-        
-        # Simulated Angel Broker API connection
-        connection_data = {
-            "status": "connected",
-            "broker": current_user.broker_name,
-            "client_id": current_user.client_id,
-            "message": "Successfully connected to Angel Broker"
-        }
-        
-        return connection_data
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to connect to broker: {str(e)}")
+    profile = await broker_client.get_profile(broker_session["access_token"], api_key)
+    
+    return {
+        "status": "connected",
+        "broker": current_user.broker_name,
+        "client_id": broker_session["client_id"],
+        "exchanges": profile.get("exchanges", []),
+        "message": "Successfully connected to Angel Broker"
+    }
 
 
 @router.get("/portfolio")
 async def get_portfolio(
     current_user: User = Depends(require_broker_or_admin),
-    db: Session = Depends(get_db)
+    broker_session: dict = Depends(get_broker_session)
 ):
     """Get user portfolio from broker"""
-    if not current_user.access_token:
+    if not broker_session.get("access_token"):
         raise HTTPException(status_code=400, detail="Not connected to broker")
     
-    # Simulated portfolio data
-    portfolio = {
-        "holdings": [
-            {"symbol": "RELIANCE", "quantity": 10, "avg_price": 2500.00, "current_price": 2550.00},
-            {"symbol": "TCS", "quantity": 5, "avg_price": 3200.00, "current_price": 3250.00},
-            {"symbol": "INFY", "quantity": 15, "avg_price": 1400.00, "current_price": 1450.00}
-        ],
-        "total_value": 95750.00,
-        "total_investment": 93500.00,
-        "profit_loss": 2250.00,
-        "profit_loss_percentage": 2.41
-    }
+    api_key = get_api_key(current_user)
+    holdings = await broker_client.get_holdings(broker_session["access_token"], api_key)
     
-    return portfolio
+    portfolio = Portfolio.from_holdings(holdings)
+    # Kept for admin aggregates; quotes fetched later revalue it in place
+    # (quote_prices in utils.portfolio, fed by the utils.quote_cache fetches)
+    portfolio_book.set(current_user.id, portfolio)
+    
+    return {"holdings": portfolio.positions(), **portfolio.totals()}
 
 
 @router.get("/market-data")
 async def get_market_data(
     symbol: str = "NIFTY50",
-    current_user: User = Depends(require_broker_or_admin)
+    exchange: str = "NSE",
+    current_user: User = Depends(require_broker_or_admin),
+    broker_session: dict = Depends(get_broker_session)
 ):
-    """Get market data for a symbol"""
-    if not current_user.feed_token:
+    """Get market data for a symbol (its Angel exchange token)"""
+    if not broker_session.get("feed_token"):
         raise HTTPException(status_code=400, detail="Feed token not available")
     
-    # Simulated market data
-    market_data = {
-        "symbol": symbol,
-        "price": 19500.50,
-        "change": 125.30,
-        "change_percent": 0.65,
-        "volume": 1250000,
-        "high": 19550.00,
-        "low": 19400.00,
-        "open": 19425.00,
-        "timestamp": "2024-01-15T15:30:00Z"
-    }
+    api_key = get_api_key(current_user)
+    
+    async def fetch_quote() -> dict:
+        quotes = await broker_client.get_quotes(
+            broker_session["access_token"], api_key, {exchange: [symbol]}
+        )
+        fetched = (quotes or {}).get("fetched") or []
+        if not fetched:
+            raise HTTPException(status_code=404, detail=f"No quote for {symbol}")
+        portfolio_book.update_prices(quote_prices(fetched))
+        return fetched[0]
+    
+    # Quotes are market-wide, so one upstream call serves every user asking
+    quote = await quote_cache.get((exchange, symbol), fetch_quote, shared_quote_error)
+    return quote_to_market_data(symbol, quote)
+
+
+@router.post("/market-data/batch")
+async def get_market_data_batch(
+    request: MarketDataBatch,
+    current_user: User = Depends(require_broker_or_admin),
+    broker_session: dict = Depends(get_broker_session)
+):
+    """Get market data for many symbols in one request (e.g. a watchlist)"""
+    if not broker_session.get("feed_token"):
+        raise HTTPException(status_code=400, detail="Feed token not available")
+    if len(request.symbols) > settings.market_data_batch_max_symbols:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.market_data_batch_max_symbols} symbols per request"
+        )
+    
+    keys = []
+    for item in request.symbols:
+        exchange, _, symbol = item.rpartition(":")
+        keys.append(((exchange or request.exchange).upper(), symbol))
     
-    return market_data
+    api_key = get_api_key(current_user)
+    
+    async def fetch_quotes(missing):
+        # Cache misses from the whole request share a few broker batch calls
+        found = await broker_client.get_quotes_many(broker_session["access_token"], api_key, missing)
+        portfolio_book.update_prices(quote_prices(q for q in found.values() if isinstance(q, dict)))
+        return found
+    
+    found = await quote_cache.get_many(keys, fetch_quotes, shared_quote_error)
+    
+    quotes, errors = [], []
+    for exchange, symbol in dict.fromkeys(keys):
+        quote = found[(exchange, symbol)]
+        if isinstance(quote, KeyError):
+            errors.append({"symbol": symbol, "exchange": exchange, "error": f"No quote for {symbol}"})
+        elif isinstance(quote, (BrokerError, BrokerUnavailable)):
+            errors.append({"symbol": symbol, "exchange": exchange, "error": str(quote)})
+        elif isinstance(quote, Exception):
+            raise quote
+        else:
+            quotes.append({**quote_to_market_data(symbol, quote), "exchange": exchange})
+    
+    return {"quotes": quotes, "errors": errors}
+
+
+def order_result(order: Order, replayed: bool = False) -> OrderResult:
+    return OrderResult(
+        id=order.id,
+        order_id=order.broker_order_id,
+        status=order.status,
+        symbol=order.symbol,
+        quantity=order.quantity,
+        price=order.price,
+        order_type=order.order_type,
+        transaction_type=order.transaction_type,
+        timestamp=order.created_at or datetime.now(timezone.utc),
+        message="Order placed successfully",
+        replayed=replayed
+    )
 
 
-@router.post("/place-order")
+async def get_order_by_key(db: AsyncSession, user_id: int, idempotency_key: str) -> Optional[Order]:
+    result = await db.execute(
+        select(Order).where(Order.user_id == user_id, Order.idempotency_key == idempotency_key)
+    )
+    return result.scalar_one_or_none()
+
+
+def replay_order(order: Order) -> OrderResult:
+    """Answer a resubmission with the journaled outcome of the first attempt"""
+    if order.status == "SUBMITTING":
+        raise HTTPException(status_code=409, detail="An order with this idempotency key is still being placed")
+    if order.status == "UNKNOWN":
+        raise HTTPException(
+            status_code=409,
+            detail="The outcome of the order with this idempotency key is not known yet; retry later"
+        )
+    if order.status == "REJECTED":
+        raise BrokerError(order.error or "Order rejected by broker")
+    return order_result(order, replayed=True)
+
+
+def order_tag(order_id: int) -> str:
+    """Tag sent with placeOrder so the order can be found in the broker's order book"""
+    return f"sa{order_id}"
+
+
+def age_seconds(timestamp: Optional[datetime]) -> float:
+    if timestamp is None:
+        return float("inf")
+    if timestamp.tzinfo is None:
+        # SQLite returns CURRENT_TIMESTAMP values without a zone; they are UTC
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - timestamp).total_seconds()
+
+
+async def journal(order_id: int, **values) -> None:
+    # Shielded so a cancelled request still records what happened to its order
+    await asyncio.shield(order_journal.record(order_id, **values))
+
+
+async def reconcile_order(order: Order, broker_session: dict, api_key: str) -> Optional[Order]:
+    """Settle an UNKNOWN order from the broker's order book.
+
+    SUBMITTING orders are treated the same once they are old enough: their
+    process died mid-submit, or the broker's answer could not be journaled.
+    Returns the order (unchanged while it is younger than
+    ``order_reconcile_after_seconds``), or None if the broker never received
+    it, in which case its idempotency key has been released.
+    """
+    if order.status not in ("UNKNOWN", "SUBMITTING") or \
+            age_seconds(order.updated_at or order.created_at) < settings.order_reconcile_after_seconds:
+        return order
+    book = await broker_client.get_order_book(broker_session["access_token"], api_key)
+    placed = next((entry for entry in book if entry.get("ordertag") == order_tag(order.id)), None)
+    if placed is None:
+        await journal(order.id, status="FAILED", error="Not found in the broker's order book", idempotency_key=None)
+        return None
+    if placed.get("orderstatus") == "rejected":
+        values = {"status": "REJECTED", "error": placed.get("text") or "Order rejected by broker"}
+    else:
+        values = {"status": "PENDING", "error": None}
+    values["broker_order_id"] = placed.get("orderid")
+    await journal(order.id, **values)
+    for key, value in values.items():
+        setattr(order, key, value)
+    return order
+
+
+async def place_or_replay(
+    current_user: User, broker_session: dict, api_key: str, order: OrderCreate,
+    idempotency_key: Optional[str], existing: Optional[Order]
+) -> OrderResult:
+    """Replay the journaled order for the key, if any, else submit ``order``"""
+    if existing is not None:
+        existing = await reconcile_order(existing, broker_session, api_key)
+        if existing is not None:
+            return replay_order(existing)
+    return await submit_order(current_user, broker_session, api_key, order, idempotency_key)
+
+
+@router.post("/place-order", response_model=OrderResult)
 async def place_order(
-    order_data: Dict[str, Any],
+    order: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=64),
     current_user: User = Depends(require_broker_or_admin),
-    db: Session = Depends(get_db)
+    broker_session: dict = Depends(get_broker_session),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Place an order through the broker"""
-    if not current_user.access_token:
+    """Place an order through the broker.
+
+    Send an ``Idempotency-Key`` header to make retries safe: a repeated key
+    returns the stored result without contacting the broker again.
+    """
+    if not broker_session.get("access_token"):
         raise HTTPException(status_code=400, detail="Not connected to broker")
     
-    # Validate order data
-    required_fields = ["symbol", "quantity", "price", "order_type", "transaction_type"]
-    for field in required_fields:
-        if field not in order_data:
-            raise HTTPException(status_code=400, detail=f"Missing required field: {field}")
-    
-    # Simulated order placement
-    order_response = {
-        "order_id": "ORD123456789",
-        "status": "PENDING",
-        "symbol": order_data["symbol"],
-        "quantity": order_data["quantity"],
-        "price": order_data["price"],
-        "order_type": order_data["order_type"],
-        "transaction_type": order_data["transaction_type"],
-        "timestamp": "2024-01-15T15:30:00Z",
-        "message": "Order placed successfully"
+    existing = None
+    if idempotency_key:
+        existing = await get_order_by_key(db, current_user.id, idempotency_key)
+    # Hand the connection back before waiting on the broker or the journal,
+    # which needs one from the same pool to commit; detached first so the
+    # rollback does not expire the row
+    db.expunge_all()
+    await db.rollback()
+    
+    api_key = get_api_key(current_user)
+    return await place_or_replay(current_user, broker_session, api_key, order, idempotency_key, existing)
+
+
+async def submit_order(
+    current_user: User, broker_session: dict, api_key: str, order: OrderCreate, idempotency_key: Optional[str]
+) -> OrderResult:
+    """Journal an order, send it to the broker and record the outcome"""
+    values = {
+        "user_id": current_user.id,
+        "idempotency_key": idempotency_key,
+        "status": "SUBMITTING",
+        "symbol": order.symbol,
+        "symbol_token": order.symbol_token,
+        "exchange": order.exchange,
+        "transaction_type": order.transaction_type.value,
+        "order_type": order.order_type.value,
+        "product_type": order.product_type.value,
+        "variety": order.variety,
+        "quantity": order.quantity,
+        "price": order.price,
     }
+    for _ in range(3):
+        order_id = await order_journal.reserve(values)
+        if order_id is not None:
+            break
+        # A concurrent request with the same key got there first
+        async with AsyncSessionLocal() as db:
+            existing = await get_order_by_key(db, current_user.id, idempotency_key)
+        if existing is not None:
+            existing = await reconcile_order(existing, broker_session, api_key)
+            if existing is not None:
+                return replay_order(existing)
+        # Its order never reached the broker and the key was released: retry
+    else:
+        raise HTTPException(status_code=409, detail="An order with this idempotency key is still being placed")
+    
+    try:
+        result = await broker_client.place_order(broker_session["access_token"], api_key, {
+            "variety": order.variety,
+            "tradingsymbol": order.symbol,
+            "symboltoken": order.symbol_token,
+            "transactiontype": order.transaction_type.value,
+            "exchange": order.exchange,
+            "ordertype": order.order_type.value,
+            "producttype": order.product_type.value,
+            "duration": "DAY",
+            "price": str(order.price),
+            "quantity": str(order.quantity),
+            "ordertag": order_tag(order_id),
+        }, client_id=broker_session.get("client_id"))
+        broker_order_id = result["orderid"]
+    except BrokerError as exc:
+        await journal(order_id, status="REJECTED", error=str(exc))
+        raise
+    except BrokerUnavailable as exc:
+        if exc.sent:
+            # placeOrder is not idempotent: a timeout or 5xx may still have
+            # placed it, so the key stays taken until reconciliation
+            await journal(order_id, status="UNKNOWN", error=str(exc))
+        else:
+            # Never reached the broker: free the key so the client can retry it
+            await journal(order_id, status="FAILED", error=str(exc), idempotency_key=None)
+        raise
+    except BaseException as exc:
+        # Cancelled, or failed unexpectedly, after the order may have been sent
+        await journal(order_id, status="UNKNOWN", error=f"Interrupted while placing: {exc.__class__.__name__}")
+        raise
+    
+    try:
+        await journal(order_id, status="PENDING", broker_order_id=broker_order_id)
+    except Exception:
+        # The broker has the order, so the client gets its id regardless; the
+        # row is left to reconciliation (a SUBMITTING row ages into it too)
+        logger.exception("Could not journal placed order %d (broker order %s)", order_id, broker_order_id)
+        with suppress(Exception):
+            await journal(order_id, status="UNKNOWN", broker_order_id=broker_order_id,
+                          error="Placed, but the outcome could not be journaled")
+    
+    return OrderResult(
+        id=order_id,
+        order_id=broker_order_id,
+        status="PENDING",
+        symbol=order.symbol,
+        quantity=order.quantity,
+        price=order.price,
+        order_type=order.order_type.value,
+        transaction_type=order.transaction_type.value,
+        timestamp=datetime.now(timezone.utc),
+        message="Order placed successfully"
+    )
+
+
+@router.post("/basket-order")
+async def place_basket_order(
+    basket: BasketOrder,
+    idempotency_key: Optional[str] = Header(None, max_length=56),
+    current_user: User = Depends(require_broker_or_admin),
+    broker_session: dict = Depends(get_broker_session),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Place many orders at once, concurrently.
+
+    Streams one NDJSON line per leg as it finishes ({"index", "status",
+    "order" or "error"}), then a summary line. Legs share the client's
+    order-rate budget, so a large basket is paced rather than rejected
+    upstream. With an ``Idempotency-Key`` header, leg ``i`` uses
+    ``<key>:<i>``, so resubmitting a basket only places the missing legs.
+    """
+    if not broker_session.get("access_token"):
+        raise HTTPException(status_code=400, detail="Not connected to broker")
+    if len(basket.orders) > settings.basket_max_orders:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.basket_max_orders} orders per basket"
+        )
+    
+    api_key = get_api_key(current_user)
+    keys = [f"{idempotency_key}:{index}" if idempotency_key else None for index in range(len(basket.orders))]
+    existing = {}
+    if idempotency_key:
+        result = await db.execute(
+            select(Order).where(Order.user_id == current_user.id, Order.idempotency_key.in_(keys))
+        )
+        existing = {order.idempotency_key: order for order in result.scalars()}
+    # Detach so the rollback below (which releases the connection) does
+    # not expire the rows the legs replay from
+    db.expunge_all()
+    await db.rollback()
     
-    return order_response
\ No newline at end of file
+    async def run_leg(index: int, order: OrderCreate, key: Optional[str]) -> dict:
+        try:
+            placed = await place_or_replay(current_user, broker_session, api_key, order, key, existing.get(key))
+        except HTTPException as exc:
+            return {"index": index, "status": "error", "error": exc.detail}
+        except (BrokerError, BrokerUnavailable) as exc:
+            return {"index": index, "status": "error", "error": str(exc)}
+        except Exception:
+            logger.exception("Basket leg %d failed", index)
+            return {"index": index, "status": "error", "error": "Internal error"}
+        return {
+            "index": index,
+            "status": "replayed" if placed.replayed else "placed",
+            "order": placed.model_dump(mode="json")
+        }
+    
+    # Legs run as their own tasks so a client disconnect does not abandon
+    # orders mid-flight
+    legs = [asyncio.ensure_future(run_leg(index, order, key))
+            for index, (order, key) in enumerate(zip(basket.orders, keys))]
+    for leg in legs:
+        _basket_legs.add(leg)
+        leg.add_done_callback(_basket_legs.discard)
+    
+    async def stream_results():
+        failed = 0
+        for finished in asyncio.as_completed(legs):
+            result = await finished
+            failed += result["status"] == "error"
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"done": True, "succeeded": len(legs) - failed, "failed": failed}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@router.get("/orders", response_model=List[OrderRecord])
+async def list_orders(
+    order_status: Optional[str] = Query(None, alias="status"),
+    cursor: Optional[int] = Query(None, description="Last order id from the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(require_broker_or_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """The current user's orders, newest first, optionally by status"""
+    stmt = select(Order).where(Order.user_id == current_user.id)
+    if order_status:
+        stmt = stmt.where(Order.status == order_status.upper())
+    if cursor is not None:
+        stmt = stmt.where(Order.id < cursor)
+    result = await db.execute(stmt.order_by(Order.id.desc()).limit(limit))
+    return result.scalars().all()
+
+
+@router.get("/orders/{order_id}", response_model=OrderRecord)
+async def get_order(
+    order_id: int,
+    current_user: User = Depends(require_broker_or_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """One of the current user's journaled orders"""
+    result = await db.execute(
+        select(Order).where(Order.id == order_id, Order.user_id == current_user.id)
+    )
+    order = result.scalar_one_or_none()
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
@@ -1,19 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List
 
 from database import get_db
 from models import User
-from schemas import User as UserSchema, UserUpdate
-from routers.auth import get_current_user
+from schemas import User as UserSchema, UserUpdate, USER_FIELDS
+from routers.auth import get_current_principal, get_current_user, duplicate_field
+from utils.principal_cache import principal_cache
+from utils.responses import json_response
 
 router = APIRouter()
 
 
+def principal_response(principal: dict):
+    # The snapshot holds the row's column values, so no ORM object or
+    # response-model validation is needed to render it
+    return json_response({field: principal[field] for field in USER_FIELDS})
+
+
 @router.get("/me", response_model=UserSchema)
-def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(principal: dict = Depends(get_current_principal)):
     """Get current user information"""
-    return current_user
+    return principal_response(principal)
 
 
 @router.put("/me", response_model=UserSchema)
@@ -25,24 +34,11 @@ def update_current_user(
     """Update current user information"""
     from utils.security import encrypt_data
     
+    # Username/email uniqueness is enforced by the unique indexes on commit
     if user_update.username is not None:
-        # Check if username is already taken
-        existing_user = db.query(User).filter(
-            User.username == user_update.username,
-            User.id != current_user.id
-        ).first()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Username already taken")
         current_user.username = user_update.username
     
     if user_update.email is not None:
-        # Check if email is already taken
-        existing_user = db.query(User).filter(
-            User.email == user_update.email,
-            User.id != current_user.id
-        ).first()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Email already taken")
         current_user.email = user_update.email
     
     if user_update.broker_name is not None:
@@ -51,12 +47,18 @@ def update_current_user(
     if user_update.api_key is not None:
         current_user.encrypted_api_key = encrypt_data(user_update.api_key)
     
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        field = duplicate_field(exc)
+        raise HTTPException(status_code=400, detail=f"{field.capitalize()} already taken")
+    principal_cache.invalidate_user(current_user.id)
     db.refresh(current_user)
     return current_user
 
 
 @router.get("/profile", response_model=UserSchema)
-def get_user_profile(current_user: User = Depends(get_current_user)):
+async def get_user_profile(principal: dict = Depends(get_current_principal)):
     """Get user profile with broker information"""
-    return current_user
\ No newline at end of file
+    return principal_response(principal)
\ No newline at end of file
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -41,6 +41,10 @@ class User(UserBase):
         from_attributes = True
 
 
+# Response field order of User, for routes that build it from column values
+USER_FIELDS = tuple(User.model_fields)
+
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -62,10 +66,121 @@ class TokenData(BaseModel):
     username: Optional[str] = None
 
 
+class QRFormat(str, Enum):
+    PNG = "png"
+    SVG = "svg"
+    MATRIX = "matrix"
+
+
 class TOTPSetup(BaseModel):
     secret: str
     qr_code: str
+    qr_format: QRFormat = QRFormat.PNG
 
 
 class TOTPVerify(BaseModel):
-    token: str
\ No newline at end of file
+    token: str
+
+class MarketDataBatch(BaseModel):
+    # Exchange tokens; "EXCHANGE:token" overrides the default exchange
+    symbols: List[str]
+    exchange: str = "NSE"
+
+
+class TransactionType(str, Enum):
+    BUY = "BUY"
+    SELL = "SELL"
+
+
+class OrderType(str, Enum):
+    MARKET = "MARKET"
+    LIMIT = "LIMIT"
+    STOPLOSS_LIMIT = "STOPLOSS_LIMIT"
+    STOPLOSS_MARKET = "STOPLOSS_MARKET"
+
+
+class ProductType(str, Enum):
+    DELIVERY = "DELIVERY"
+    INTRADAY = "INTRADAY"
+    CARRYFORWARD = "CARRYFORWARD"
+    MARGIN = "MARGIN"
+    BO = "BO"
+
+
+class OrderCreate(BaseModel):
+    symbol: str = Field(min_length=1, max_length=50)
+    symbol_token: str = Field("", max_length=20)
+    exchange: str = "NSE"
+    quantity: int = Field(gt=0)
+    price: float = Field(ge=0)
+    order_type: OrderType
+    transaction_type: TransactionType
+    product_type: ProductType = ProductType.DELIVERY
+    variety: str = "NORMAL"
+
+
+class BasketOrder(BaseModel):
+    orders: List[OrderCreate] = Field(min_length=1)
+
+
+class OrderResult(BaseModel):
+    id: int
+    order_id: Optional[str] = None
+    status: str
+    symbol: str
+    quantity: int
+    price: float
+    order_type: str
+    transaction_type: str
+    timestamp: datetime
+    message: str
+    replayed: bool = False
+
+
+class OrderRecord(BaseModel):
+    id: int
+    idempotency_key: Optional[str] = None
+    status: str
+    broker_order_id: Optional[str] = None
+    error: Optional[str] = None
+    symbol: str
+    symbol_token: Optional[str] = None
+    exchange: str
+    transaction_type: str
+    order_type: str
+    product_type: str
+    variety: str
+    quantity: int
+    price: float
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class BulkAction(str, Enum):
+    ACTIVATE = "activate"
+    DEACTIVATE = "deactivate"
+    DELETE = "delete"
+    SET_ROLE = "set_role"
+
+
+class BulkUserAction(BaseModel):
+    action: BulkAction
+    user_ids: List[int]
+    role: Optional[UserRole] = None
+
+
+class BulkRowResult(BaseModel):
+    index: int
+    status: str  # created, updated, deleted, error
+    id: Optional[int] = None
+    username: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkRowResult]
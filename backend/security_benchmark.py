@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the utils.security primitives
+
+Measures ops/sec (best and median of --repeat timed runs) and memory per
+call (tracemalloc peak and retained bytes) for password hashing and
+verification, JWT encode/decode, Fernet encrypt/decrypt, TOTP
+verification (valid_window=2) and QR generation, across bcrypt rounds,
+JWT algorithms and QR formats/box sizes. These set the per-core capacity
+of login, every authenticated request and 2FA setup.
+
+Runs are appended to a JSON-lines history with --record; --history
+compares against the latest recorded run and exits non-zero if any case
+lost more than --max-regression of its ops/sec. Installed versions of the
+crypto dependencies are recorded alongside, so a dependency upgrade that
+slows login shows up next to the run that introduced it.
+
+    python security_benchmark.py
+    python security_benchmark.py --bcrypt-rounds 10,12,13 --jwt-algorithms HS256,HS512
+    python security_benchmark.py --history security_bench_history.jsonl --record
+    python security_benchmark.py --only bcrypt,jwt --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from importlib import metadata
+
+from config import settings
+from utils import security
+
+PASSWORD = "BenchPass123!"
+API_KEY = "bench-api-key-0123456789abcdef"
+JWT_ALGORITHMS = ("HS256", "HS384", "HS512")
+DEPENDENCIES = ("passlib", "bcrypt", "python-jose", "cryptography", "pyotp", "qrcode", "pypng")
+GROUPS = ("bcrypt", "jwt", "fernet", "totp", "qr")
+
+
+def build_cases(args):
+    """(group, name, setup) where setup() applies the case's settings and returns the call to time"""
+    cases = []
+
+    for rounds in args.bcrypt_rounds:
+        def bcrypt_setup(rounds=rounds):
+            settings.bcrypt_rounds = rounds
+            security.get_pwd_context.cache_clear()
+            return lambda: security.get_password_hash(PASSWORD)
+
+        def verify_setup(rounds=rounds):
+            settings.bcrypt_rounds = rounds
+            security.get_pwd_context.cache_clear()
+            hashed = security.get_password_hash(PASSWORD)
+            return lambda: security.verify_password(PASSWORD, hashed)
+
+        cases.append(("bcrypt", f"get_password_hash[rounds={rounds}]", bcrypt_setup))
+        cases.append(("bcrypt", f"verify_password[rounds={rounds}]", verify_setup))
+
+    for algorithm in args.jwt_algorithms:
+        def encode_setup(algorithm=algorithm):
+            settings.algorithm = algorithm
+            return lambda: security.create_access_token({"sub": "benchuser", "uid": 1})
+
+        def decode_setup(algorithm=algorithm):
+            settings.algorithm = algorithm
+            token = security.create_access_token({"sub": "benchuser", "uid": 1})
+            return lambda: security.verify_token(token)
+
+        cases.append(("jwt", f"create_access_token[alg={algorithm}]", encode_setup))
+        cases.append(("jwt", f"verify_token[alg={algorithm}]", decode_setup))
+
+    def encrypt_setup():
+        return lambda: security.encrypt_data(API_KEY)
+
+    def decrypt_setup():
+        token = security.encrypt_data(API_KEY)
+        return lambda: security.decrypt_data(token)
+
+    cases.append(("fernet", "encrypt_data", encrypt_setup))
+    cases.append(("fernet", "decrypt_data", decrypt_setup))
+
+    def totp_setup(valid: bool):
+        import pyotp
+
+        secret = security.generate_totp_secret()
+        # A wrong code is the slow path: every step in the window is tried
+        token = pyotp.TOTP(secret).now() if valid else "000000"
+        return lambda: security.verify_totp(secret, token)
+
+    cases.append(("totp", "verify_totp[window=2,valid]", lambda: totp_setup(True)))
+    cases.append(("totp", "verify_totp[window=2,invalid]", lambda: totp_setup(False)))
+
+    for box_size in args.qr_box_sizes:
+        for qr_format in args.qr_formats:
+            def qr_setup(box_size=box_size, qr_format=qr_format):
+                settings.qr_box_size = box_size
+                secrets = [security.generate_totp_secret() for _ in range(64)]
+                state = {"index": 0}
+
+                def generate():
+                    # Fresh secrets so the render cache never hits
+                    state["index"] += 1
+                    security.render_qr_code.cache_clear()
+                    return security.generate_qr_code("benchuser", secrets[state["index"] % len(secrets)], qr_format)
+                return generate
+
+            cases.append(("qr", f"generate_qr_code[format={qr_format},box={box_size}]", qr_setup))
+
+    return [case for case in cases if case[0] in args.only]
+
+
+def time_case(fn, min_time: float, min_ops: int) -> float:
+    """Ops/sec over at least ``min_ops`` calls and ``min_time`` seconds"""
+    ops = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while ops < min_ops or elapsed < min_time:
+        fn()
+        ops += 1
+        elapsed = time.perf_counter() - started
+    return ops / elapsed
+
+
+def measure_memory(fn, calls: int) -> dict:
+    """Peak traced bytes during one call (worst of ``calls``) and bytes still held per call afterwards"""
+    fn()  # first-call imports and caches are not the primitive's cost
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        peak = 0
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, call_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, call_peak - before)
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_bytes": peak, "retained_bytes_per_call": round((retained - baseline) / calls, 1)}
+
+
+def run_case(name: str, setup, args) -> dict:
+    fn = setup()
+    fn()  # warm up
+    rates = [time_case(fn, args.min_time, args.min_ops) for _ in range(args.repeat)]
+    result = {
+        "ops_per_sec": round(max(rates), 2),
+        "median_ops_per_sec": round(statistics.median(rates), 2),
+        "us_per_op": round(1e6 / max(rates), 2),
+    }
+    result.update(measure_memory(fn, args.memory_calls))
+    return result
+
+
+def dependency_versions() -> dict:
+    versions = {}
+    for name in DEPENDENCIES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def load_latest(path: str):
+    """Most recent run recorded in a JSON-lines history, or None"""
+    if not os.path.exists(path):
+        return None
+    latest = None
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                latest = json.loads(line)
+    return latest
+
+
+def compare(results: dict, previous: dict, max_regression: float):
+    failures = []
+    for name, current in results["cases"].items():
+        before = previous.get("cases", {}).get(name)
+        if before and current["ops_per_sec"] < before["ops_per_sec"] * (1 - max_regression):
+            failures.append(f"{name}: {current['ops_per_sec']:.1f} ops/s < {before['ops_per_sec']:.1f} "
+                            f"-{max_regression:.0%}")
+    changed = {
+        name: (previous.get("meta", {}).get("dependencies", {}).get(name), version)
+        for name, version in results["meta"]["dependencies"].items()
+        if previous.get("meta", {}).get("dependencies", {}).get(name) != version
+    }
+    return failures, changed
+
+
+def csv_list(cast):
+    return lambda value: [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bcrypt-rounds", type=csv_list(int), default=[settings.bcrypt_rounds])
+    parser.add_argument("--jwt-algorithms", type=csv_list(str), default=[settings.algorithm])
+    parser.add_argument("--qr-formats", type=csv_list(str), default=["png"])
+    parser.add_argument("--qr-box-sizes", type=csv_list(int), default=[settings.qr_box_size])
+    parser.add_argument("--only", type=csv_list(str), default=list(GROUPS),
+                        help=f"comma-separated groups: {', '.join(GROUPS)}")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds per timed run")
+    parser.add_argument("--min-ops", type=int, default=3, help="calls per timed run, at least")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--memory-calls", type=int, default=5, help="calls traced for allocations")
+    parser.add_argument("--output", help="write this run as JSON")
+    parser.add_argument("--history", help="JSON-lines history to compare against (latest run)")
+    parser.add_argument("--record", action="store_true", help="append this run to --history")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="allowed ops/sec drop against the history (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    unsupported = [algorithm for algorithm in args.jwt_algorithms if algorithm not in JWT_ALGORITHMS]
+    if unsupported:
+        parser.error(f"only HMAC algorithms ({', '.join(JWT_ALGORITHMS)}) work with SECRET_KEY")
+    bad_formats = [qr_format for qr_format in args.qr_formats if qr_format not in security.QR_FORMATS]
+    if bad_formats:
+        parser.error(f"QR formats must be among {', '.join(security.QR_FORMATS)}")
+    if args.record and not args.history:
+        parser.error("--record needs --history")
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "dependencies": dependency_versions(),
+        },
+        "cases": {},
+    }
+    print(f"{'case':<44} {'ops/s':>10} {'median':>10} {'us/op':>10} {'peak KiB':>9} {'kept B':>8}")
+    for group, name, setup in build_cases(args):
+        result = run_case(name, setup, args)
+        results["cases"][name] = result
+        print(f"{name:<44} {result['ops_per_sec']:10.1f} {result['median_ops_per_sec']:10.1f} "
+              f"{result['us_per_op']:10.1f} {result['peak_bytes'] / 1024:9.1f} "
+              f"{result['retained_bytes_per_call']:8.0f}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    failures = []
+    if args.history:
+        previous = load_latest(args.history)
+        if previous is None:
+            print(f"no previous run in {args.history}")
+        else:
+            failures, changed = compare(results, previous, args.max_regression)
+            print(f"compared with run of {previous['meta']['timestamp']}")
+            for name, (before, after) in changed.items():
+                print(f"dependency changed: {name} {before} -> {after}")
+            for failure in failures:
+                print(f"REGRESSION: {failure}", file=sys.stderr)
+        if args.record:
+            with open(args.history, "a") as f:
+                f.write(json.dumps(results) + "\n")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Per-request CPU of the user endpoints and of their JSON serialization
+
+Seeds a throwaway database (see load_benchmark.py) and measures:
+
+  requests  process CPU and wall time per request, one request at a time,
+            for GET /api/users/me and GET /api/admin/users?limit=N
+  encode    serializing N user rows only: ORM objects validated through
+            the UserSchema response model and rendered by JSONResponse
+            (what a response_model route does) against column tuples
+            rendered by utils.responses, with and without orjson
+
+    python serialization_benchmark.py
+    python serialization_benchmark.py --limit 100 --requests 500 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from load_benchmark import Context, configure_environment, seed_users
+
+
+def summarize(cpu_samples, wall_samples) -> dict:
+    return {
+        "cpu_us_mean": round(statistics.fmean(cpu_samples) * 1e6, 1),
+        "cpu_us_p50": round(statistics.median(cpu_samples) * 1e6, 1),
+        "wall_us_p50": round(statistics.median(wall_samples) * 1e6, 1),
+    }
+
+
+async def bench_requests(users, args) -> dict:
+    import httpx
+
+    from main import app
+
+    ctx = Context(users, seed=0)
+    endpoints = {
+        "GET /api/users/me": ("/api/users/me", {}, ctx.broker_headers[0]),
+        f"GET /api/admin/users?limit={args.limit}": (
+            "/api/admin/users", {"limit": args.limit, "cursor": 0}, ctx.admin_headers
+        ),
+    }
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, (path, params, headers) in endpoints.items():
+                for _ in range(args.warmup):
+                    (await client.get(path, params=params, headers=headers)).raise_for_status()
+                cpu, wall = [], []
+                for _ in range(args.requests):
+                    cpu_started, wall_started = time.process_time(), time.perf_counter()
+                    response = await client.get(path, params=params, headers=headers)
+                    cpu.append(time.process_time() - cpu_started)
+                    wall.append(time.perf_counter() - wall_started)
+                    response.raise_for_status()
+                results[name] = {**summarize(cpu, wall), "bytes": len(response.content)}
+    return results
+
+
+def bench_encode(args) -> dict:
+    from typing import List
+
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+
+    from database import SessionLocal
+    from models import User
+    from schemas import USER_FIELDS, User as UserSchema
+    from utils import responses
+
+    adapter = TypeAdapter(List[UserSchema])
+    columns = [getattr(User, field) for field in USER_FIELDS]
+
+    def orm_pydantic(db):
+        users = db.execute(select(User).order_by(User.id).limit(args.limit)).scalars().all()
+        content = adapter.dump_python(adapter.validate_python(users, from_attributes=True), mode="json")
+        return JSONResponse(content).body
+
+    def column_rows(db):
+        rows = db.execute(select(*columns).order_by(User.id).limit(args.limit)).all()
+        return responses.json_response(responses.rows_to_dicts(USER_FIELDS, rows)).body
+
+    def column_rows_stdlib(db):
+        orjson, responses.orjson = responses.orjson, None
+        try:
+            return column_rows(db)
+        finally:
+            responses.orjson = orjson
+
+    variants = {"orm_pydantic": orm_pydantic, "column_rows_stdlib_json": column_rows_stdlib}
+    if responses.orjson is not None:
+        variants["column_rows_orjson"] = column_rows
+
+    results = {}
+    with SessionLocal() as db:
+        bodies = {name: json.loads(fn(db)) for name, fn in variants.items()}
+        if any(body != bodies["orm_pydantic"] for body in bodies.values()):
+            raise SystemExit("serialization variants disagree on the output")
+        for name, fn in variants.items():
+            cpu, wall = [], []
+            for _ in range(args.requests):
+                db.expunge_all()
+                cpu_started, wall_started = time.process_time(), time.perf_counter()
+                fn(db)
+                cpu.append(time.process_time() - cpu_started)
+                wall.append(time.perf_counter() - wall_started)
+            results[name] = summarize(cpu, wall)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="accounts to seed")
+    parser.add_argument("--limit", type=int, default=100, help="rows per admin page")
+    parser.add_argument("--requests", type=int, default=300, help="measured calls per case")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--only", choices=("requests", "encode"), help="run one part")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="stockauth-bench-") as directory:
+        configure_environment(os.path.join(directory, "bench.db"))
+        users = seed_users(args.users)
+        if args.only in (None, "requests"):
+            results["requests"] = asyncio.run(bench_requests(users, args))
+        if args.only in (None, "encode"):
+            results["encode"] = bench_encode(args)
+
+        from database import engine, async_engine
+        engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+    print(f"{'case':<40} {'cpu us mean':>12} {'cpu us p50':>11} {'wall us p50':>12}")
+    for part, cases in results.items():
+        print(f"[{part}]")
+        for name, result in cases.items():
+            print(f"  {name:<38} {result['cpu_us_mean']:12.1f} {result['cpu_us_p50']:11.1f} "
+                  f"{result['wall_us_p50']:12.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
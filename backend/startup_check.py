@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Cold-start report and budget check for the API
+
+Runs each measurement in a fresh interpreter: imports ``main`` under
+``-X importtime``, then drives the ASGI lifespan startup and a first
+GET /health. Prints the slowest imports and exits non-zero if the median
+cold start exceeds the budget.
+
+    python startup_check.py                # budget from STARTUP_BUDGET_MS
+    python startup_check.py --budget-ms 800 --runs 5 --top 25
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from config import settings
+
+# Executed in the child interpreter. Talks ASGI directly so no HTTP client
+# (and its imports) is loaded before the app is measured.
+PROBE = r"""
+import asyncio, json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+
+async def probe():
+    startup = asyncio.Queue()
+    await startup.put({"type": "lifespan.startup"})
+    ready = asyncio.Event()
+    async def lifespan_send(message):
+        if message["type"].startswith("lifespan.startup"):
+            ready.set()
+    lifespan = asyncio.create_task(main.app({"type": "lifespan", "asgi": {"version": "3.0"}}, startup.get, lifespan_send))
+    await ready.wait()
+    t2 = time.perf_counter()
+    sent = []
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(message):
+        sent.append(message)
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/health", "raw_path": b"/health", "query_string": b"",
+             "root_path": "", "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 0),
+             "server": ("localhost", 80)}
+    await main.app(scope, receive, send)
+    t3 = time.perf_counter()
+    await startup.put({"type": "lifespan.shutdown"})
+    await lifespan
+    return t2, t3, sent[0]["status"]
+
+t2, t3, status = asyncio.run(probe())
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "startup_ms": (t2 - t1) * 1000,
+                  "first_request_ms": (t3 - t2) * 1000, "total_ms": (t3 - t0) * 1000,
+                  "status": status}))
+"""
+
+
+def parse_importtime(stderr: str):
+    """(cumulative_us, self_us, module) for each line of -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue  # header line
+        entries.append((cumulative_us, self_us, fields[2].rstrip()))
+    return entries
+
+
+def run_probe():
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        capture_output=True, text=True, check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result, parse_importtime(completed.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=settings.startup_budget_ms)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    args = parser.parse_args()
+
+    # The first run also warms the bytecode cache, so it is not counted
+    run_probe()
+    results, imports = [], []
+    for _ in range(args.runs):
+        result, imports = run_probe()
+        results.append(result)
+
+    median = {key: statistics.median(r[key] for r in results)
+              for key in ("import_ms", "startup_ms", "first_request_ms", "total_ms")}
+    slowest = sorted(imports, reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({"median": median, "runs": results, "budget_ms": args.budget_ms,
+                          "slowest_imports": [{"module": m.strip(), "cumulative_ms": c / 1000, "self_ms": s / 1000}
+                                              for c, s, m in slowest]}, indent=2))
+    else:
+        print(f"Slowest imports of {len(imports)} (last run):")
+        print(f"  {'cumulative':>11} {'self':>9}  module")
+        for cumulative_us, self_us, module in slowest:
+            print(f"  {cumulative_us / 1000:9.1f}ms {self_us / 1000:7.1f}ms  {module}")
+        print()
+        print(f"import main:    {median['import_ms']:8.1f} ms")
+        print(f"lifespan:       {median['startup_ms']:8.1f} ms")
+        print(f"first /health:  {median['first_request_ms']:8.1f} ms")
+        print(f"cold start:     {median['total_ms']:8.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if median["total_ms"] > args.budget_ms:
+        print(f"FAIL: cold start {median['total_ms']:.1f} ms exceeds budget {args.budget_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Tuple
+import time
+
+from config import settings
+from utils.security import decrypt_data_bytes
+
+
+class ApiKeyCache:
+    """Short-lived per-user cache of decrypted broker API keys.
+
+    Plaintext is held in ``bytearray`` buffers that are overwritten with
+    zeros when an entry expires, is evicted, replaced or invalidated, so
+    the cache's copy does not linger in memory. Callers still receive an
+    ordinary ``str``, which Python cannot zero. Entries are tied to the
+    ciphertext they came from, so a changed or re-encrypted key is a miss.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, Tuple[float, str, bytearray]]" = OrderedDict()
+        self._lock = Lock()
+        self._next_prune = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.zeroed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, user_id: int, encrypted_api_key: str) -> str:
+        """Decrypted API key for ``user_id``, decrypting only on a miss"""
+        if not self.enabled:
+            plaintext = decrypt_data_bytes(encrypted_api_key)
+            try:
+                return plaintext.decode()
+            finally:
+                self._zero(plaintext)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now and entry[1] == encrypted_api_key:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[2].decode()
+            self.misses += 1
+
+        plaintext = decrypt_data_bytes(encrypted_api_key)
+        with self._lock:
+            self._remove(user_id)
+            self._entries[user_id] = (now + self.ttl_seconds, encrypted_api_key, plaintext)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            if now >= self._next_prune:
+                # Expired keys of users who stopped calling are zeroed here
+                self._prune(now)
+                self._next_prune = now + self.ttl_seconds
+            return plaintext.decode()
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._remove(user_id)
+
+    def prune(self) -> None:
+        """Zero and drop expired entries"""
+        with self._lock:
+            self._prune(time.monotonic())
+
+    def clear(self) -> None:
+        with self._lock:
+            for user_id in list(self._entries):
+                self._remove(user_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "zeroed": self.zeroed,
+            }
+
+    def _remove(self, user_id: int) -> None:
+        # Caller must hold the lock
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._zero(entry[2])
+
+    def _prune(self, now: float) -> None:
+        # Caller must hold the lock
+        for user_id in [user_id for user_id, entry in self._entries.items() if entry[0] <= now]:
+            self._remove(user_id)
+
+    def _zero(self, buffer: bytearray) -> None:
+        buffer[:] = bytes(len(buffer))
+        self.zeroed += 1
+
+
+api_key_cache = ApiKeyCache(
+    max_entries=settings.api_key_cache_max_entries,
+    ttl_seconds=settings.api_key_cache_ttl_seconds,
+)
@@ -0,0 +1,380 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+
+# Angel SmartAPI endpoints
+PROFILE_PATH = "/rest/secure/angelbroking/user/v1/getProfile"
+HOLDINGS_PATH = "/rest/secure/angelbroking/portfolio/v1/getHolding"
+QUOTE_PATH = "/rest/secure/angelbroking/market/v1/quote/"
+PLACE_ORDER_PATH = "/rest/secure/angelbroking/order/v1/placeOrder"
+ORDER_BOOK_PATH = "/rest/secure/angelbroking/order/v1/getOrderBook"
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Angel accepts at most 50 tokens per quote request
+QUOTE_BATCH_SIZE = 50
+
+
+class BrokerError(Exception):
+    """The broker answered, but with an error"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, error_code: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+
+
+class BrokerUnavailable(Exception):
+    """The broker could not be reached, or the circuit breaker is open.
+
+    ``sent`` is False only when the request certainly never reached the
+    broker (connect failure, pool timeout, open circuit); otherwise a
+    non-idempotent call such as placeOrder may have taken effect.
+    """
+
+    def __init__(self, message: str, sent: bool = False):
+        super().__init__(message)
+        self.sent = sent
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After ``failure_threshold`` failures in a row the circuit opens and
+    calls fail fast for ``reset_timeout`` seconds; then a single trial call
+    is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            now = time.monotonic()
+            # A trial that never reported back (e.g. cancelled) expires too
+            if self._trial_started is None or now - self._trial_started >= self.reset_timeout:
+                self._trial_started = now
+                return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_started = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """Token bucket whose waiters queue by reserving future tokens.
+
+    Each caller takes a token immediately, letting the balance go negative;
+    the deficit tells it how long to sleep, so concurrent callers are spaced
+    ``1 / rate`` apart in arrival order without polling.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token; returns the seconds to wait before using it"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class ClientThrottle:
+    """Per-client_id token buckets, bounded to the most recent clients.
+
+    An evicted bucket belongs to a client that has been idle longest, so
+    it would have refilled anyway.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.acquired = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self, client_id: str) -> None:
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = self._buckets[client_id] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_id)
+        delay = bucket.reserve()
+        self.acquired += 1
+        if delay > 0:
+            self.delayed += 1
+            self.wait_seconds += delay
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "acquired": self.acquired,
+            "delayed": self.delayed,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class AngelClient:
+    """Async Angel SmartAPI client sharing one pooled ``httpx.AsyncClient``.
+
+    Keep-alive connections are reused across requests and users. Idempotent
+    calls are retried with jittered exponential backoff; everything else is
+    only retried when the request never reached the broker (connect errors).
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = 10.0,
+        connect_timeout: float = 3.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        max_retries: int = 2,
+        retry_backoff: float = 0.2,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        order_throttle: Optional[ClientThrottle] = None,
+        simulated: bool = False,
+        transport=None,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(5, 30.0)
+        self.order_throttle = order_throttle or ClientThrottle(20.0, 1.0)
+        self.simulated = simulated
+        self.transport = transport
+        self._client = None
+
+    @classmethod
+    def from_settings(cls) -> "AngelClient":
+        return cls(
+            base_url=settings.angel_api_url,
+            timeout=settings.broker_timeout_seconds,
+            connect_timeout=settings.broker_connect_timeout_seconds,
+            max_connections=settings.broker_max_connections,
+            max_keepalive_connections=settings.broker_max_keepalive_connections,
+            keepalive_expiry=settings.broker_keepalive_expiry_seconds,
+            http2=settings.broker_http2,
+            max_retries=settings.broker_max_retries,
+            retry_backoff=settings.broker_retry_backoff_seconds,
+            circuit_breaker=CircuitBreaker(
+                settings.broker_circuit_failure_threshold, settings.broker_circuit_reset_seconds
+            ),
+            order_throttle=ClientThrottle(settings.broker_orders_per_second, settings.broker_order_burst),
+            simulated=settings.broker_simulated,
+        )
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+        import httpx
+        
+        transport = self.transport
+        if transport is None and self.simulated:
+            # In-process stand-in; no sockets, same code path as production
+            from utils.broker_simulator import app as simulator
+            
+            transport = httpx.ASGITransport(app=simulator)
+
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            http2=self.http2,
+            transport=transport,
+            headers={
+                "Accept": "application/json",
+                "X-UserType": "USER",
+                "X-SourceID": "WEB",
+                "X-ClientLocalIP": "127.0.0.1",
+                "X-ClientPublicIP": "127.0.0.1",
+                "X-MACAddress": "00:00:00:00:00:00",
+            },
+        )
+
+    async def close(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "circuit_state": self.circuit_breaker.state,
+            "consecutive_failures": self.circuit_breaker.failures,
+            "order_throttle": self.order_throttle.stats(),
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: spreads retries from many workers instead of syncing them
+        return random.uniform(0, self.retry_backoff * (2 ** attempt))
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        access_token: str,
+        api_key: str,
+        json: Optional[dict] = None,
+        idempotent: bool = True,
+        timeout: Optional[float] = None,
+    ):
+        """Call an Angel endpoint and return the ``data`` of its envelope"""
+        import httpx
+
+        if self._client is None:
+            await self.start()
+        if not self.circuit_breaker.allow():
+            raise BrokerUnavailable("Broker circuit is open")
+
+        headers = {"Authorization": f"Bearer {access_token}", "X-PrivateKey": api_key}
+        attempt = 0
+        while True:
+            try:
+                response = await self._client.request(
+                    method, path, json=json, headers=headers,
+                    timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+                )
+            except httpx.TransportError as exc:
+                # A request that never connected is safe to resend even if not idempotent
+                retryable = idempotent or isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+                if retryable and attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                self.circuit_breaker.record_failure()
+                sent = not isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                raise BrokerUnavailable(f"Broker request failed: {exc.__class__.__name__}", sent=sent) from exc
+
+            if response.status_code in RETRYABLE_STATUS:
+                if idempotent and attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                self.circuit_breaker.record_failure()
+                raise BrokerUnavailable(f"Broker returned HTTP {response.status_code}", sent=True)
+
+            self.circuit_breaker.record_success()
+            if response.status_code >= 400:
+                raise BrokerError(f"Broker returned HTTP {response.status_code}", response.status_code)
+            body = response.json()
+            if not body.get("status", False):
+                raise BrokerError(body.get("message") or "Broker request failed",
+                                  response.status_code, body.get("errorcode", ""))
+            return body.get("data")
+
+    async def get_profile(self, access_token: str, api_key: str) -> dict:
+        return await self.request("GET", PROFILE_PATH, access_token, api_key)
+
+    async def get_holdings(self, access_token: str, api_key: str) -> List[dict]:
+        return await self.request("GET", HOLDINGS_PATH, access_token, api_key) or []
+
+    async def get_quotes(
+        self, access_token: str, api_key: str, exchange_tokens: Dict[str, List[str]], mode: str = "FULL"
+    ) -> dict:
+        # Quote lookups are reads, so they are retried despite being POSTs
+        return await self.request(
+            "POST", QUOTE_PATH, access_token, api_key,
+            json={"mode": mode, "exchangeTokens": exchange_tokens},
+        )
+
+    async def get_quotes_many(
+        self, access_token: str, api_key: str, keys: List[Tuple[str, str]], mode: str = "FULL"
+    ) -> Dict[Tuple[str, str], object]:
+        """Quotes for many (exchange, token) pairs, in concurrent batch calls.
+
+        Each key maps to its quote, or to the exception explaining why it has
+        none; a failed batch only fails the keys it carried.
+        """
+        batches = [keys[i:i + QUOTE_BATCH_SIZE] for i in range(0, len(keys), QUOTE_BATCH_SIZE)]
+
+        async def fetch_batch(batch: List[Tuple[str, str]]) -> dict:
+            exchange_tokens: Dict[str, List[str]] = {}
+            for exchange, token in batch:
+                exchange_tokens.setdefault(exchange, []).append(token)
+            return await self.get_quotes(access_token, api_key, exchange_tokens, mode) or {}
+
+        responses = await asyncio.gather(*(fetch_batch(batch) for batch in batches), return_exceptions=True)
+        results: Dict[Tuple[str, str], object] = {}
+        for batch, response in zip(batches, responses):
+            if isinstance(response, BaseException):
+                if not isinstance(response, Exception):
+                    raise response
+                results.update((key, response) for key in batch)
+                continue
+            for quote in response.get("fetched") or []:
+                results[(quote.get("exchange"), quote.get("symbolToken"))] = quote
+            for miss in response.get("unfetched") or []:
+                results[(miss.get("exchange"), miss.get("symbolToken"))] = BrokerError(
+                    miss.get("message") or "No quote", error_code=miss.get("errorCode", "")
+                )
+        return results
+
+    async def place_order(
+        self, access_token: str, api_key: str, order: dict, client_id: Optional[str] = None
+    ) -> dict:
+        """Place an order, first waiting for ``client_id``'s order-rate budget"""
+        if client_id:
+            await self.order_throttle.acquire(client_id)
+        return await self.request(
+            "POST", PLACE_ORDER_PATH, access_token, api_key, json=order, idempotent=False
+        )
+
+    async def get_order_book(self, access_token: str, api_key: str) -> List[dict]:
+        """Today's orders for the session, used to reconcile orders with an unknown outcome"""
+        return await self.request("GET", ORDER_BOOK_PATH, access_token, api_key) or []
+
+
+broker_client = AngelClient.from_settings()
@@ -0,0 +1,102 @@
+"""
+Stand-in for the Angel SmartAPI endpoints used by utils.broker_client
+
+Serves the same simulated data the broker routes used to hard-code, in
+Angel's response envelope. Used in-process when BROKER_SIMULATED is on,
+or as a local stub server for testing the real client path:
+
+    uvicorn utils.broker_simulator:app --port 9000
+    ANGEL_API_URL=http://localhost:9000 BROKER_SIMULATED=false uvicorn main:app
+"""
+from datetime import datetime, timezone
+import itertools
+
+from fastapi import FastAPI, Header, HTTPException
+
+app = FastAPI(title="Angel SmartAPI simulator")
+
+HOLDINGS = [
+    {"tradingsymbol": "RELIANCE", "symboltoken": "2885", "exchange": "NSE", "quantity": 10, "averageprice": 2500.00, "ltp": 2550.00},
+    {"tradingsymbol": "TCS", "symboltoken": "11536", "exchange": "NSE", "quantity": 5, "averageprice": 3200.00, "ltp": 3250.00},
+    {"tradingsymbol": "INFY", "symboltoken": "1594", "exchange": "NSE", "quantity": 15, "averageprice": 1400.00, "ltp": 1450.00},
+]
+
+_order_ids = itertools.count(123456789)
+# Order book per access token, as getOrderBook returns it
+_order_books = {}
+
+
+def _ok(data):
+    return {"status": True, "message": "SUCCESS", "errorcode": "", "data": data}
+
+
+def _require_auth(authorization):
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Invalid Token")
+
+
+def _quote(token: str, exchange: str) -> dict:
+    return {
+        "exchange": exchange,
+        "tradingSymbol": token,
+        "symbolToken": token,
+        "ltp": 19500.50,
+        "open": 19425.00,
+        "high": 19550.00,
+        "low": 19400.00,
+        "close": 19375.20,
+        "netChange": 125.30,
+        "percentChange": 0.65,
+        "tradeVolume": 1250000,
+        "exchFeedTime": "15-Jan-2024 15:30:00",
+    }
+
+
+@app.get("/rest/secure/angelbroking/user/v1/getProfile")
+async def get_profile(authorization: str = Header(None)):
+    _require_auth(authorization)
+    return _ok({"clientcode": "SIMULATED", "name": "Simulated Client", "exchanges": ["NSE", "BSE"]})
+
+
+@app.get("/rest/secure/angelbroking/portfolio/v1/getHolding")
+async def get_holding(authorization: str = Header(None)):
+    _require_auth(authorization)
+    return _ok(HOLDINGS)
+
+
+@app.post("/rest/secure/angelbroking/market/v1/quote/")
+async def quote(body: dict, authorization: str = Header(None)):
+    _require_auth(authorization)
+    exchange_tokens = body.get("exchangeTokens", {})
+    if sum(len(tokens) for tokens in exchange_tokens.values()) > 50:
+        return {"status": False, "message": "Maximum 50 tokens per request", "errorcode": "AB4009", "data": None}
+    fetched = [
+        _quote(token, exchange)
+        for exchange, tokens in exchange_tokens.items()
+        for token in tokens
+    ]
+    return _ok({"fetched": fetched, "unfetched": []})
+
+
+@app.post("/rest/secure/angelbroking/order/v1/placeOrder")
+async def place_order(body: dict, authorization: str = Header(None)):
+    _require_auth(authorization)
+    order_id = str(next(_order_ids))
+    _order_books.setdefault(authorization, []).append({
+        **body,
+        "orderid": order_id,
+        "ordertag": body.get("ordertag", ""),
+        "orderstatus": "open",
+        "text": "",
+    })
+    return _ok({
+        "script": body.get("tradingsymbol"),
+        "orderid": order_id,
+        "uniqueorderid": datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f"),
+    })
+
+
+@app.get("/rest/secure/angelbroking/order/v1/getOrderBook")
+async def get_order_book(authorization: str = Header(None)):
+    _require_auth(authorization)
+    return _ok(_order_books.get(authorization) or None)
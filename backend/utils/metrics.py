@@ -0,0 +1,362 @@
+"""
+In-process metrics in Prometheus text exposition format
+
+Counters and histograms accumulate into per-thread shards, so recording is
+a dict lookup and an add with no lock; shards are only merged when /metrics
+is scraped. Stdlib only, so importing this stays off the cold-start path.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock, local
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+Labels = Tuple[str, ...]
+
+
+class _Sharded:
+    """Per-thread ``{labels: series}`` dicts, merged on collection"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = local()
+        self._shards: List[dict] = []
+        self._shards_lock = Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _series(self) -> List[Tuple[Labels, object]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # list() of a dict is a single C call, so no concurrent resize issue
+        return [item for shard in shards for item in list(shard.items())]
+
+    def _labels(self, labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        totals: Dict[Labels, float] = {}
+        for labels, value in self._series():
+            totals[labels] = totals.get(labels, 0) + value
+        return [f"{self.name}{self._labels(labels)} {_number(value)}" for labels, value in sorted(totals.items())]
+
+
+class Gauge(_Sharded):
+    """Summed across threads, so inc/dec may happen on different threads"""
+
+    kind = "gauge"
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def dec(self, labels: Labels = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    render = Counter.render
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # Per-bucket (non-cumulative) counts, the +Inf bucket, then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, labels: Labels = ()):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, labels)
+
+    def render(self) -> List[str]:
+        merged: Dict[Labels, list] = {}
+        for labels, series in self._series():
+            total = merged.get(labels)
+            if total is None:
+                merged[labels] = list(series)
+            else:
+                for index, value in enumerate(series):
+                    total[index] += value
+        lines = []
+        for labels, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{self._labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Sharded] = []
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, Dict[str, str], float]]]) -> None:
+        """Register a scrape-time source of (name, help, labels, value) gauge samples"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        seen = set()
+        for collector in self.collectors:
+            for name, help, labels, value in collector():
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {help}")
+                    lines.append(f"# TYPE {name} gauge")
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_number(value)}" if label_text else f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+)
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being served")
+db_queries = registry.histogram(
+    "db_queries_per_request", "SQL statements executed per HTTP request", ("route",), COUNT_BUCKETS
+)
+db_time = registry.histogram(
+    "db_time_per_request_seconds", "Time spent in SQL statements per HTTP request", ("route",)
+)
+security_latency = registry.histogram(
+    "security_operation_duration_seconds",
+    "Time spent in utils.security primitives (bcrypt, JWT, Fernet, TOTP, QR)", ("operation",)
+)
+
+
+def timed(operation: str):
+    """Record a function's duration in security_operation_duration_seconds"""
+    labels = (operation,)
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                security_latency.observe(time.perf_counter() - started, labels)
+        return wrapper
+    return decorator
+
+
+class RequestDbStats:
+    """SQL statements run on behalf of one request. Mutable, so worker
+    threads that copy the request's context add to the same object"""
+
+    __slots__ = ("count", "seconds", "scope", "statements")
+
+    def __init__(self, scope=None, per_statement: bool = False):
+        self.count = 0
+        self.seconds = 0.0
+        self.scope = scope
+        # statement -> [executions, total seconds, slowest execution], kept
+        # only when a profiler asked for it (utils.sql_profiler)
+        self.statements: Optional[Dict[str, list]] = {} if per_statement else None
+
+    def add(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.seconds += elapsed
+        if self.statements is None:
+            return
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+
+
+current_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("current_db_stats", default=None)
+
+# Called as observer(statement, elapsed, executemany, stats) after every
+# statement, inside requests or not (stats is then None)
+_statement_observers: List[Callable] = []
+
+
+def add_statement_observer(observer: Callable) -> None:
+    _statement_observers.append(observer)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context rather than the connection,
+    # so a statement that raises (no after_cursor_execute) leaves nothing behind
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = current_db_stats.get()
+    if stats is not None:
+        stats.add(statement, elapsed)
+    for observer in _statement_observers:
+        observer(statement, elapsed, executemany, stats)
+
+
+def instrument_engine(engine) -> None:
+    """Count statements and DB time per request on a (sync) Engine"""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+
+
+def route_template(scope) -> str:
+    endpoint = scope.get("endpoint")
+    router = scope.get("router")
+    if endpoint is None or router is None:
+        return "unmatched"
+    routes = _route_paths.get(id(router))
+    if routes is None:
+        routes = _route_paths[id(router)] = {
+            getattr(route, "endpoint", None): route.path for route in router.routes
+        }
+    return routes.get(endpoint, "unmatched")
+
+
+_route_paths: Dict[int, Dict[Callable, str]] = {}
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status, in-flight and DB usage per route
+
+    With a ``profiler`` (utils.sql_profiler.SqlProfiler) each request's
+    statements are also kept one by one and handed to it when the request
+    ends; it may add response headers through ``response_headers(stats)``.
+    """
+
+    def __init__(self, app, exclude: Sequence[str] = ("/metrics",), profiler=None):
+        self.app = app
+        self.exclude = set(exclude)
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profiler is not None:
+                    extra = profiler.response_headers(stats)
+                    if extra:
+                        message = {**message, "headers": [*message.get("headers", []), *extra]}
+            await send(message)
+
+        profiler = self.profiler
+        stats = RequestDbStats(scope, per_statement=profiler is not None)
+        token = current_db_stats.set(stats)
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            current_db_stats.reset(token)
+            route = route_template(scope)
+            method = scope["method"]
+            http_requests.inc((method, route, str(status_code)))
+            http_latency.observe(elapsed, (method, route))
+            db_queries.observe(stats.count, (route,))
+            db_time.observe(stats.seconds, (route,))
+            if profiler is not None:
+                profiler.finish(stats)
+
+
+def stats_collector(prefix: str, source: Callable[[], dict], labels: Optional[Dict[str, str]] = None):
+    """Expose the numeric values of a component's ``stats()`` dict as gauges"""
+    def collect():
+        for key, value in source().items():
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    if isinstance(sub_value, (int, float)):
+                        yield f"{prefix}_{key}_{sub_key}", f"{prefix} {key} {sub_key}", labels or {}, sub_value
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}_{key}", f"{prefix} {key}", labels or {}, value
+    return collect
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import update
+
+from config import settings
+from database import AsyncSessionLocal
+from models import Order
+
+
+def _insert(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+class OrderJournal:
+    """Group-commit writer for the orders table.
+
+    Writes queue up while the previous transaction commits; a single
+    background task then applies everything queued in one transaction,
+    so a burst of orders shares commits instead of paying one each.
+    Callers still await their own write, so a returned write is durable.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, max_batch: int = 200, max_delay: float = 0.0):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.commits = 0
+        self.largest_batch = 0
+        self.commit_seconds = 0.0
+        self.split_batches = 0
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._worker is not None and not self._worker.done() and self._worker.get_loop() is loop:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = loop.create_task(self._run())
+
+    async def close(self) -> None:
+        worker, self._worker = self._worker, None
+        if worker is None or worker.done():
+            return
+        # Let queued writes finish, then stop
+        await self._queue.put(None)
+        await worker
+
+    async def _submit(self, statement, returning: bool):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((statement, returning, future))
+        return await future
+
+    async def reserve(self, values: dict) -> Optional[int]:
+        """Journal a new order; None if its idempotency key is already taken"""
+        insert = _insert(self.session_factory.kw["bind"].dialect.name)
+        statement = insert(Order).values(**values).on_conflict_do_nothing().returning(Order.id)
+        return await self._submit(statement, returning=True)
+
+    async def record(self, order_id: int, **values) -> None:
+        """Update a journaled order with the broker's answer"""
+        await self._submit(update(Order).where(Order.id == order_id).values(**values), returning=False)
+
+    async def _next_batch(self) -> Tuple[List[tuple], bool]:
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._next_batch()
+            if batch:
+                await self._write(batch)
+
+    async def _write(self, batch: List[tuple]) -> None:
+        started = time.perf_counter()
+        try:
+            results = await self._apply(batch)
+        except Exception as exc:
+            if len(batch) == 1:
+                _fail(batch[0][2], exc)
+                return
+            # One bad write (e.g. an order for a user deleted meanwhile) must
+            # not fail everyone else's: redo the batch a statement at a time
+            self.split_batches += 1
+            for item in batch:
+                await self._write([item])
+            return
+        self.writes += len(batch)
+        self.commits += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self.commit_seconds += time.perf_counter() - started
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _apply(self, batch: List[tuple]) -> list:
+        """Run the batch's statements in one transaction; all or nothing"""
+        results = []
+        async with self.session_factory() as session:
+            for statement, returning, _ in batch:
+                result = await session.execute(statement)
+                results.append(result.scalar_one_or_none() if returning else result.rowcount)
+            await session.commit()
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.writes,
+            "commits": self.commits,
+            "writes_per_commit": round(self.writes / self.commits, 2) if self.commits else 0.0,
+            "largest_batch": self.largest_batch,
+            "avg_commit_ms": round(self.commit_seconds / self.commits * 1000, 3) if self.commits else 0.0,
+            "split_batches": self.split_batches,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+def _fail(future: asyncio.Future, exc: Exception) -> None:
+    if not future.done():
+        future.set_exception(exc)
+
+
+order_journal = OrderJournal(
+    max_batch=settings.order_journal_max_batch,
+    max_delay=settings.order_journal_max_delay_ms / 1000,
+)
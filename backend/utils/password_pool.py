@@ -0,0 +1,119 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from config import settings
+from utils.metrics import registry
+from utils.security import get_password_hash, verify_and_update_password
+
+# Measured here rather than in the job, so process-pool jobs are counted too
+password_job_latency = registry.histogram(
+    "password_pool_job_seconds", "Password job time from submission to result (queue + bcrypt)", ("job",)
+)
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when more password jobs are waiting than the pool allows"""
+
+
+class PasswordPool:
+    """Dedicated, size-limited executor for bcrypt work.
+
+    Keeps slow hashing off both the event loop and the default threadpool
+    that serves sync routes. With ``kind="process"`` the work runs in
+    separate processes, so several cores can hash at once.
+    """
+
+    def __init__(self, workers: int, kind: str = "thread", max_queue: int = 64):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown password pool kind: {kind}")
+        self.workers = workers
+        self.kind = kind
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._lock = Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_pending_seen = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: forking a process that already runs threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password"
+                )
+        return self._executor
+
+    def _submit(self, fn, *args) -> "asyncio.Future":
+        with self._lock:
+            if self._pending - self.workers >= self.max_queue:
+                self.rejected += 1
+                raise PasswordPoolSaturated("Password hashing queue is full")
+            future = self._get_executor().submit(fn, *args)
+            self._pending += 1
+            self.submitted += 1
+            self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        future.add_done_callback(partial(self._on_done, fn.__name__, time.perf_counter()))
+        return asyncio.wrap_future(future)
+
+    def _on_done(self, job: str, submitted_at: float, future: Future) -> None:
+        password_job_latency.observe(time.perf_counter() - submitted_at, (job,))
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(get_password_hash, password)
+
+    async def hash_many(self, passwords: List[str]) -> List[str]:
+        """Hash in parallel, keeping at most ``workers`` jobs in the pool so
+        a bulk import never fills the queue that logins depend on"""
+        limit = asyncio.Semaphore(self.workers)
+
+        async def hash_one(password: str) -> str:
+            async with limit:
+                return await self.hash(password)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._submit(verify_and_update_password, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": min(self._pending, self.workers),
+                "queue_depth": max(self._pending - self.workers, 0),
+                "max_pending_seen": self.max_pending_seen,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+password_pool = PasswordPool(
+    workers=settings.password_hash_workers,
+    kind=settings.password_hash_executor,
+    max_queue=settings.password_hash_max_queue,
+)
@@ -0,0 +1,219 @@
+# Columnar portfolio valuation. numpy is imported on first use so it stays
+# out of the cold-start path. Prices arrive from the market-data routes'
+# quote fetches (utils.quote_cache) as quote_prices() mappings.
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import settings
+
+Key = Tuple[str, str]  # (exchange, symbol token)
+
+
+class Portfolio:
+    """One account's holdings as parallel arrays.
+
+    ``quantity``, ``avg_price`` and ``last_price`` hold one row per position.
+    Investment only changes with the holdings, so it is computed once;
+    market value is kept as a running total that ``update_prices`` adjusts
+    by the change on the affected rows only.
+    """
+
+    def __init__(self, symbols: List[str], keys: List[Key], quantity, avg_price, last_price):
+        import numpy as np
+
+        self.symbols = symbols
+        self.keys = keys
+        self.quantity = np.asarray(quantity, dtype=np.int64)
+        self.avg_price = np.asarray(avg_price, dtype=np.float64)
+        self.last_price = np.asarray(last_price, dtype=np.float64)
+        self._rows: Dict[Key, int] = {key: row for row, key in enumerate(keys)}
+        self.investment = float(self.quantity @ self.avg_price)
+        self.value = float(self.quantity @ self.last_price)
+
+    @classmethod
+    def from_holdings(cls, holdings: List[dict]) -> "Portfolio":
+        """Build from Angel getHolding rows"""
+        return cls(
+            symbols=[h["tradingsymbol"] for h in holdings],
+            keys=[(h.get("exchange", "NSE"), str(h.get("symboltoken", h["tradingsymbol"]))) for h in holdings],
+            quantity=[h["quantity"] for h in holdings],
+            avg_price=[h["averageprice"] for h in holdings],
+            last_price=[h["ltp"] for h in holdings],
+        )
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def update_prices(self, prices: Dict[Key, float]) -> int:
+        """Apply new last prices; returns how many positions changed"""
+        import numpy as np
+
+        rows = [self._rows[key] for key in prices if key in self._rows]
+        if not rows:
+            return 0
+        rows = np.fromiter(rows, dtype=np.intp, count=len(rows))
+        new = np.fromiter(
+            (prices[self.keys[row]] for row in rows), dtype=np.float64, count=len(rows)
+        )
+        self.value += float(self.quantity[rows] @ (new - self.last_price[rows]))
+        self.last_price[rows] = new
+        return len(rows)
+
+    def recompute(self) -> None:
+        """Recompute the running value from scratch (drops float drift)"""
+        self.value = float(self.quantity @ self.last_price)
+
+    def totals(self) -> dict:
+        profit_loss = self.value - self.investment
+        return {
+            "total_value": round(self.value, 2),
+            "total_investment": round(self.investment, 2),
+            "profit_loss": round(profit_loss, 2),
+            "profit_loss_percentage": round(profit_loss / self.investment * 100, 2) if self.investment else 0.0,
+        }
+
+    def positions(self) -> List[dict]:
+        return [
+            {"symbol": symbol, "quantity": quantity, "avg_price": avg_price, "current_price": last_price}
+            for symbol, quantity, avg_price, last_price in zip(
+                self.symbols, self.quantity.tolist(), self.avg_price.tolist(), self.last_price.tolist()
+            )
+        ]
+
+
+def aggregate(portfolios: Iterable[Portfolio], top: int = 20) -> dict:
+    """Totals across accounts plus the largest per-symbol exposures"""
+    import numpy as np
+
+    portfolios = [p for p in portfolios if len(p)]
+    accounts = len(portfolios)
+    if not portfolios:
+        return {"accounts": 0, "positions": 0, "total_value": 0.0, "total_investment": 0.0,
+                "profit_loss": 0.0, "profit_loss_percentage": 0.0, "top_exposures": []}
+
+    keys = [key for p in portfolios for key in p.keys]
+    symbols = [symbol for p in portfolios for symbol in p.symbols]
+    quantity = np.concatenate([p.quantity for p in portfolios])
+    value = quantity * np.concatenate([p.last_price for p in portfolios])
+    investment = quantity * np.concatenate([p.avg_price for p in portfolios])
+
+    # Group rows by instrument across accounts
+    index: Dict[Key, int] = {}
+    group_symbols: List[str] = []
+    groups = []
+    for key, symbol in zip(keys, symbols):
+        group = index.get(key)
+        if group is None:
+            group = index[key] = len(group_symbols)
+            group_symbols.append(symbol)
+        groups.append(group)
+    groups = np.asarray(groups, dtype=np.intp)
+    group_quantity = np.bincount(groups, weights=quantity, minlength=len(index))
+    group_value = np.bincount(groups, weights=value, minlength=len(index))
+    order = np.argsort(group_value)[::-1][:top]
+
+    total_value = float(value.sum())
+    total_investment = float(investment.sum())
+    profit_loss = total_value - total_investment
+    group_keys = list(index)
+    return {
+        "accounts": accounts,
+        "positions": len(keys),
+        "total_value": round(total_value, 2),
+        "total_investment": round(total_investment, 2),
+        "profit_loss": round(profit_loss, 2),
+        "profit_loss_percentage": round(profit_loss / total_investment * 100, 2) if total_investment else 0.0,
+        "top_exposures": [
+            {
+                "symbol": group_symbols[group],
+                "exchange": group_keys[group][0],
+                "quantity": int(group_quantity[group]),
+                "value": round(float(group_value[group]), 2),
+            }
+            for group in order.tolist()
+        ],
+    }
+
+
+class PortfolioBook:
+    """Latest portfolio per user, kept current by incoming quotes.
+
+    Bounded LRU keyed by user id, with an instrument -> users index so a
+    quote only touches the portfolios that hold it.
+    """
+
+    def __init__(self, max_accounts: int = 10000):
+        self.max_accounts = max_accounts
+        self._portfolios: "OrderedDict[int, Portfolio]" = OrderedDict()
+        self._holders: Dict[Key, Set[int]] = {}
+        self._lock = Lock()
+        self.price_updates = 0
+
+    def _unindex(self, user_id: int, portfolio: Portfolio) -> None:
+        for key in portfolio.keys:
+            holders = self._holders.get(key)
+            if holders is not None:
+                holders.discard(user_id)
+                if not holders:
+                    del self._holders[key]
+
+    def set(self, user_id: int, portfolio: Portfolio) -> None:
+        if self.max_accounts <= 0:
+            return
+        with self._lock:
+            previous = self._portfolios.pop(user_id, None)
+            if previous is not None:
+                self._unindex(user_id, previous)
+            self._portfolios[user_id] = portfolio
+            for key in portfolio.keys:
+                self._holders.setdefault(key, set()).add(user_id)
+            while len(self._portfolios) > self.max_accounts:
+                evicted_id, evicted = self._portfolios.popitem(last=False)
+                self._unindex(evicted_id, evicted)
+
+    def get(self, user_id: int) -> Optional[Portfolio]:
+        return self._portfolios.get(user_id)
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            portfolio = self._portfolios.pop(user_id, None)
+            if portfolio is not None:
+                self._unindex(user_id, portfolio)
+
+    def update_prices(self, prices: Dict[Key, float]) -> int:
+        """Push last prices to every portfolio holding them; returns rows changed"""
+        with self._lock:
+            affected: Dict[int, Dict[Key, float]] = {}
+            for key, price in prices.items():
+                for user_id in self._holders.get(key, ()):
+                    affected.setdefault(user_id, {})[key] = price
+            changed = sum(self._portfolios[user_id].update_prices(user_prices)
+                          for user_id, user_prices in affected.items())
+            self.price_updates += changed
+            return changed
+
+    def summary(self, top: int = 20) -> dict:
+        with self._lock:
+            portfolios = list(self._portfolios.values())
+        return aggregate(portfolios, top=top)
+
+    def stats(self) -> dict:
+        return {
+            "accounts": len(self._portfolios),
+            "max_accounts": self.max_accounts,
+            "instruments": len(self._holders),
+            "price_updates": self.price_updates,
+        }
+
+
+def quote_prices(quotes: Iterable[dict]) -> Dict[Key, float]:
+    """Last prices from Angel quote rows"""
+    return {
+        (quote.get("exchange"), str(quote.get("symbolToken"))): quote["ltp"]
+        for quote in quotes
+        if quote.get("ltp") is not None
+    }
+
+
+portfolio_book = PortfolioBook(max_accounts=settings.portfolio_book_max_accounts)
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Set, Tuple
+import time
+
+from config import settings
+
+
+class PrincipalCache:
+    """Bounded TTL/LRU cache of authenticated users, keyed by bearer token.
+
+    Entries hold a plain snapshot of the ``users`` row (column name -> value)
+    rather than ORM instances, so nothing here is tied to a database session.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, token: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, snapshot = entry
+            if expires_at <= time.monotonic():
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return snapshot
+
+    def set(self, token: str, snapshot: dict) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._tokens_by_user.setdefault(snapshot["id"], set()).add(token)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Drop every cached token that resolves to ``user_id``"""
+        with self._lock:
+            tokens = self._tokens_by_user.pop(user_id, None)
+            if not tokens:
+                return
+            for token in tokens:
+                self._entries.pop(token, None)
+            self.invalidations += len(tokens)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, token: str) -> None:
+        # Caller must hold the lock
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[1]["id"]
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+
+
+principal_cache = PrincipalCache(
+    max_entries=settings.principal_cache_max_entries,
+    ttl_seconds=settings.principal_cache_ttl_seconds,
+)
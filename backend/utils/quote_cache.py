@@ -0,0 +1,242 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import time
+
+from config import settings
+
+
+class QuoteCache:
+    """Short-TTL quote cache with single-flight fetches.
+
+    Concurrent misses for the same key share one upstream call, so upstream
+    load scales with distinct symbols rather than with users. With a
+    non-zero ``stale_seconds``, entries past their TTL are still served for
+    that long while a single background refresh runs (stale-while-revalidate).
+    Fetch errors are never cached. They are passed to every waiter, unless
+    the caller's ``shared_error`` says an error may be specific to whoever
+    started the fetch (e.g. its broker session expired); a caller that
+    joined such a fetch then tries again with its own ``fetch``.
+    """
+
+    def __init__(self, ttl_seconds: float, stale_seconds: float = 0.0, max_entries: int = 5000):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, dict]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_served = 0
+        self.upstream_calls = 0
+        self.errors = 0
+        self.retried = 0
+
+    def peek(self, key: Hashable) -> Optional[Tuple[float, dict]]:
+        """(age in seconds, value) of a cached entry, without touching counters"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[0], entry[1]
+
+    async def get(
+        self, key: Hashable, fetch: Callable[[], Awaitable[dict]],
+        shared_error: Optional[Callable[[Exception], bool]] = None
+    ) -> dict:
+        cached = self.peek(key)
+        if cached is not None:
+            age, value = cached
+            if age < self.ttl_seconds:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.stale_served += 1
+                if key not in self._inflight:
+                    self._start(key, fetch)
+                return value
+
+        # The fetch runs in its own task; shielding means a cancelled caller
+        # (the one that started it included) only stops waiting for it
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            self.misses += 1
+            return await asyncio.shield(self._start(key, fetch))
+        self.coalesced += 1
+        try:
+            return await asyncio.shield(inflight)
+        except Exception as exc:
+            if shared_error is None or shared_error(exc):
+                raise
+        self.retried += 1
+        return await self._fetch(key, fetch)
+
+    async def get_many(
+        self, keys: List[Hashable], fetch_many: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        shared_error: Optional[Callable[[Exception], bool]] = None
+    ) -> Dict[Hashable, Any]:
+        """Look up several keys, fetching every miss in one ``fetch_many`` call.
+
+        ``fetch_many`` returns a value or an exception per key; keys it leaves
+        out fail with ``KeyError``. Failures come back as exception instances
+        in the result instead of being raised, so one bad key does not sink
+        the rest.
+        """
+        results: Dict[Hashable, Any] = {}
+        waiting: Dict[Hashable, asyncio.Future] = {}
+        missing: List[Hashable] = []
+        refresh: List[Hashable] = []
+        for key in dict.fromkeys(keys):
+            cached = self.peek(key)
+            if cached is not None:
+                age, value = cached
+                if age < self.ttl_seconds:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    results[key] = value
+                    continue
+                if age < self.ttl_seconds + self.stale_seconds:
+                    self.stale_served += 1
+                    results[key] = value
+                    if key not in self._inflight:
+                        refresh.append(key)
+                    continue
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self.coalesced += 1
+                waiting[key] = inflight
+            else:
+                self.misses += 1
+                missing.append(key)
+
+        joined = set(waiting)
+        if refresh:
+            self._start_many(refresh, fetch_many)
+        if missing:
+            waiting.update(self._start_many(missing, fetch_many))
+        retry: List[Hashable] = []
+        for key, future in waiting.items():
+            try:
+                results[key] = await asyncio.shield(future)
+            except Exception as exc:
+                if key in joined and shared_error is not None and not shared_error(exc):
+                    retry.append(key)
+                else:
+                    results[key] = exc
+        if retry:
+            self.retried += len(retry)
+            results.update(await self._fetch_values(retry, fetch_many))
+        return results
+
+    def set(self, key: Hashable, value: dict) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _start(self, key: Hashable, fetch: Callable[[], Awaitable[dict]]) -> asyncio.Task:
+        task = asyncio.ensure_future(self._fetch(key, fetch))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._fetch_done(key, done))
+        return task
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        self.upstream_calls += 1
+        try:
+            value = await fetch()
+        except Exception:
+            self.errors += 1
+            raise
+        self.set(key, value)
+        return value
+
+    def _start_many(
+        self, keys: List[Hashable], fetch_many: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+    ) -> Dict[Hashable, asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in keys}
+        self._inflight.update(futures)
+        for key, future in futures.items():
+            future.add_done_callback(lambda done, key=key: self._fetch_done(key, done))
+        task = asyncio.ensure_future(self._fetch_many(futures, fetch_many))
+        # Referenced until done; the per-key futures carry the results
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return futures
+
+    async def _fetch_many(
+        self,
+        futures: Dict[Hashable, asyncio.Future],
+        fetch_many: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+    ) -> None:
+        try:
+            values = await self._fetch_values(list(futures), fetch_many)
+            for key, future in futures.items():
+                value = values[key]
+                if isinstance(value, Exception):
+                    future.set_exception(value)
+                else:
+                    future.set_result(value)
+        finally:
+            # Only reached undone if the loop itself cancels the task
+            for future in futures.values():
+                if not future.done():
+                    future.cancel()
+
+    async def _fetch_values(
+        self, keys: List[Hashable], fetch_many: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+    ) -> Dict[Hashable, Any]:
+        """A value or an exception for each of ``keys``; values are cached"""
+        self.upstream_calls += 1
+        try:
+            values = await fetch_many(keys)
+        except Exception as exc:
+            values = {key: exc for key in keys}
+        results = {}
+        for key in keys:
+            value = values.get(key)
+            if value is None:
+                value = KeyError(key)
+            if isinstance(value, Exception):
+                self.errors += 1
+            else:
+                self.set(key, value)
+            results[key] = value
+        return results
+
+    def _fetch_done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.cancelled():
+            # Retrieved so failures nobody waited for (stale refreshes,
+            # abandoned fetches) are not reported as unhandled
+            future.exception()
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced + self.stale_served
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale_served": self.stale_served,
+            "upstream_calls": self.upstream_calls,
+            "errors": self.errors,
+            "retried": self.retried,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
+
+
+quote_cache = QuoteCache(
+    ttl_seconds=settings.quote_cache_ttl_seconds,
+    stale_seconds=settings.quote_cache_stale_seconds,
+    max_entries=settings.quote_cache_max_entries,
+)
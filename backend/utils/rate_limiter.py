@@ -0,0 +1,131 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from typing import Tuple
+import math
+import time
+
+from config import settings
+
+
+def sliding_count(previous: int, current: int, window_start: float, window: float, now: float) -> float:
+    """Approximate hits in the last ``window`` seconds from two fixed windows.
+
+    The previous window is weighted by how much of it still overlaps the
+    sliding window, assuming its hits were spread evenly.
+    """
+    overlap = 1.0 - (now - window_start) / window
+    return previous * max(overlap, 0.0) + current
+
+
+class RateLimiter(ABC):
+    """Sliding-window counters keyed by string"""
+
+    def __init__(self):
+        self.allowed = 0
+        self.rejected = 0
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        """Count one attempt; returns (allowed, seconds until retry makes sense)"""
+
+    async def close(self) -> None:
+        pass
+
+    def _record(self, allowed: bool) -> None:
+        if allowed:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "allowed": self.allowed, "rejected": self.rejected}
+
+
+class InMemoryRateLimiter(RateLimiter):
+    """Per-process limiter in fixed memory.
+
+    Each key keeps three numbers (window index, previous and current
+    count). At ``max_keys`` the least recently hit key is dropped; it is the
+    one whose windows are most likely to have expired anyway.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_keys: int = 100000):
+        super().__init__()
+        self.max_keys = max_keys
+        self._counters: "OrderedDict[str, Tuple[int, int, int]]" = OrderedDict()
+        self._lock = Lock()
+        self.evicted = 0
+
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        now = time.time()
+        index = int(now // window)
+        with self._lock:
+            counter = self._counters.pop(key, None)
+            if counter is None or counter[0] < index - 1:
+                previous, current = 0, 0
+            elif counter[0] == index - 1:
+                previous, current = counter[2], 0
+            else:
+                previous, current = counter[1], counter[2]
+            self._counters[key] = (index, previous, current + 1)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+                self.evicted += 1
+        allowed = sliding_count(previous, current + 1, index * window, window, now) <= limit
+        self._record(allowed)
+        return allowed, 0.0 if allowed else window - (now - index * window)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "keys": len(self._counters), "max_keys": self.max_keys, "evicted": self.evicted}
+
+
+class RedisRateLimiter(RateLimiter):
+    """Shared limiter over the Redis protocol for multi-worker deployments.
+
+    Uses one counter per key and fixed window, expiring after two windows,
+    and the same sliding approximation as the in-memory limiter.
+    """
+
+    backend = "redis"
+    key_prefix = "rate_limit:"
+
+    def __init__(self, url: str):
+        super().__init__()
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        now = time.time()
+        index = int(now // window)
+        current_key = f"{self.key_prefix}{key}:{index}"
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.incr(current_key)
+            pipe.pexpire(current_key, int(window * 2000))
+            pipe.get(f"{self.key_prefix}{key}:{index - 1}")
+            current, _, previous = await pipe.execute()
+        allowed = sliding_count(int(previous or 0), int(current), index * window, window, now) <= limit
+        self._record(allowed)
+        return allowed, 0.0 if allowed else window - (now - index * window)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_rate_limiter() -> RateLimiter:
+    backend = settings.rate_limit_backend
+    if backend == "memory":
+        return InMemoryRateLimiter(settings.rate_limit_max_keys)
+    if backend == "redis":
+        return RedisRateLimiter(settings.redis_url)
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+rate_limiter = create_rate_limiter()
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,54 @@
+"""
+JSON rendering for hot and bulk responses
+
+``DefaultJSONResponse`` is the app's default response class: orjson's when
+orjson is installed (optional), else Starlette's stdlib JSONResponse.
+
+``json_response`` is the fast path for routes that already hold plain
+values, e.g. column tuples zipped with ``rows_to_dicts``: the content is
+encoded as-is, skipping FastAPI's response_model validation and
+jsonable_encoder pass. Output matches what the response model would have
+produced (ISO 8601 datetimes, UTC as ``Z``), so callers must only pass
+values the model would accept unchanged.
+"""
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Sequence
+import json
+
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DefaultJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+
+def _isoformat(value) -> str:
+    if isinstance(value, datetime) and value.utcoffset() == timedelta(0):
+        return value.replace(tzinfo=None).isoformat() + "Z"
+    return value.isoformat()
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return _isoformat(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def rows_to_dicts(keys: Sequence[str], rows: Iterable[Sequence]) -> List[dict]:
+    """``{key: value}`` objects from result rows whose columns are in ``keys`` order"""
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def json_response(content, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    return Response(dumps(content), status_code=status_code, headers=headers, media_type="application/json")
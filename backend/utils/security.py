@@ -1,86 +1,201 @@
+# Heavy dependencies (passlib/bcrypt, python-jose, cryptography, pyotp,
+# qrcode) are imported on first use rather than at module import, so
+# workers can start serving /health without paying for them.
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from cryptography.fernet import Fernet
-import pyotp
-import qrcode
+from typing import Optional, Tuple
+from functools import lru_cache
 from io import BytesIO
 import base64
+import binascii
+import hashlib
+import secrets
 from config import settings
+from utils.metrics import timed
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+QR_FORMATS = ("png", "svg", "matrix")
 
-# Initialize encryption - generate a proper Fernet key
-cipher_suite = Fernet(Fernet.generate_key())
 
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    from passlib.context import CryptContext
+    
+    # Hashes made with a different cost are flagged by needs_update and
+    # transparently rehashed on the next successful login
+    return CryptContext(
+        schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds
+    )
+
+
+def fernet_key(secret: str) -> bytes:
+    """A Fernet key from a setting: used as-is if it already is one,
+    otherwise derived from the string with SHA-256"""
+    try:
+        if len(base64.urlsafe_b64decode(secret.encode())) == 32:
+            return secret.encode()
+    except (binascii.Error, ValueError):
+        pass
+    return base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+
+
+def encryption_keys() -> list:
+    """Key ring order: the current key first, then retired keys still
+    accepted for decryption"""
+    retired = [key.strip() for key in settings.encryption_keys_previous.split(",") if key.strip()]
+    return [fernet_key(key) for key in [settings.encryption_key, *retired]]
+
+
+@lru_cache(maxsize=None)
+def get_cipher_suite():
+    from cryptography.fernet import Fernet, MultiFernet
+    
+    # Encrypts with the current key, decrypts with any key in the ring
+    return MultiFernet([Fernet(key) for key in encryption_keys()])
+
+
+def __getattr__(name: str):
+    # Keep the old module attributes working without eager construction
+    if name == "pwd_context":
+        return get_pwd_context()
+    if name == "cipher_suite":
+        return get_cipher_suite()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+
+@timed("bcrypt_verify")
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
+
 
+@timed("bcrypt_verify")
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password, returning a replacement hash if the stored one is outdated"""
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
 
+
+@timed("bcrypt_hash")
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 
+@timed("jwt_encode")
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
+    
     to_encode = data.copy()
+    now = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
-    to_encode.update({"exp": expire})
+        expire = now + timedelta(minutes=settings.access_token_expire_minutes)
+    # jti identifies the token for logout; iat lets a per-user cutoff
+    # revoke everything issued before it (see utils.token_revocation)
+    to_encode.update({"exp": expire, "iat": now, "jti": secrets.token_urlsafe(16)})
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
 
-def verify_token(token: str):
+@timed("jwt_decode")
+def decode_token(token: str) -> Optional[dict]:
+    """Claims of a valid, unexpired token with a subject, else None"""
+    from jose import JWTError, jwt
+    
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return username
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
 
+def verify_token(token: str):
+    payload = decode_token(token)
+    return payload["sub"] if payload is not None else None
 
+
+@timed("fernet_encrypt")
 def encrypt_data(data: str) -> str:
     """Encrypt sensitive data like API keys"""
-    return cipher_suite.encrypt(data.encode()).decode()
+    return get_cipher_suite().encrypt(data.encode()).decode()
 
 
+@timed("fernet_decrypt")
 def decrypt_data(encrypted_data: str) -> str:
     """Decrypt sensitive data"""
-    return cipher_suite.decrypt(encrypted_data.encode()).decode()
+    return get_cipher_suite().decrypt(encrypted_data.encode()).decode()
+
+
+@timed("fernet_decrypt")
+def decrypt_data_bytes(encrypted_data: str) -> bytearray:
+    """Decrypt into a mutable buffer the caller can zero after use"""
+    return bytearray(get_cipher_suite().decrypt(encrypted_data.encode()))
+
+
+@timed("fernet_rotate")
+def rotate_data(encrypted_data: str) -> str:
+    """Re-encrypt a token under the current key"""
+    return get_cipher_suite().rotate(encrypted_data.encode()).decode()
 
 
 def generate_totp_secret() -> str:
     """Generate a new TOTP secret"""
+    import pyotp
+    
     return pyotp.random_base32()
 
 
-def generate_qr_code(username: str, secret: str) -> str:
-    """Generate QR code for TOTP setup"""
+def generate_qr_code(username: str, secret: str, qr_format: str = "png") -> str:
+    """Generate QR code for TOTP setup
+    
+    ``png`` and ``svg`` are returned base64-encoded (for data: URIs),
+    ``matrix`` as newline-separated rows of 0/1 modules.
+    """
+    import pyotp
+    
     totp_uri = pyotp.totp.TOTP(secret).provisioning_uri(
         name=username,
         issuer_name="Stock Market Auth"
     )
+    return render_qr_code(totp_uri, qr_format)
+
+
+@lru_cache(maxsize=settings.qr_cache_size)
+@timed("qr_render")
+def render_qr_code(data: str, qr_format: str = "png") -> str:
+    """Render ``data`` as a QR code; cached, since the URI embeds the secret"""
+    if qr_format not in QR_FORMATS:
+        raise ValueError(f"Unsupported QR format: {qr_format}")
     
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(totp_uri)
+    import qrcode
+    import qrcode.image.pure
+    import qrcode.image.svg
+    
+    qr = qrcode.QRCode(version=1, box_size=settings.qr_box_size, border=5)
+    qr.add_data(data)
     qr.make(fit=True)
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    if qr_format == "matrix":
+        return "\n".join(
+            "".join("1" if module else "0" for module in row) for row in qr.get_matrix()
+        )
+    
+    # Both factories are pure Python, so Pillow is not needed
+    if qr_format == "svg":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        return base64.b64encode(img.to_string()).decode()
+    
+    img = qr.make_image(image_factory=qrcode.image.pure.PyPNGImage)
     buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
+    img.save(buffer)
     
     return base64.b64encode(buffer.getvalue()).decode()
 
 
+@timed("totp_verify")
 def verify_totp(secret: str, token: str) -> bool:
     """Verify TOTP token"""
+    import pyotp
+    
     try:
         totp = pyotp.TOTP(secret)
         # Use a larger valid_window to account for time drift
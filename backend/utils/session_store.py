@@ -0,0 +1,103 @@
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Dict, Optional, Tuple
+import json
+import time
+
+from config import settings
+
+
+class SessionStore(ABC):
+    """Broker session storage, keyed by user id, with per-entry TTL"""
+
+    @abstractmethod
+    async def get(self, user_id: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def set(self, user_id: int, data: dict, ttl_seconds: float) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, user_id: int) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process store; expired sessions are dropped lazily and on writes"""
+
+    def __init__(self):
+        self._sessions: Dict[int, Tuple[float, dict]] = {}
+        self._lock = Lock()
+        self._next_prune = 0.0
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._sessions[user_id]
+                return None
+            return dict(data)
+
+    async def set(self, user_id: int, data: dict, ttl_seconds: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[user_id] = (now + ttl_seconds, dict(data))
+            if now >= self._next_prune:
+                self._prune(now)
+                self._next_prune = now + 60
+
+    async def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def _prune(self, now: float) -> None:
+        # Caller must hold the lock
+        expired = [user_id for user_id, (expires_at, _) in self._sessions.items() if expires_at <= now]
+        for user_id in expired:
+            del self._sessions[user_id]
+
+
+class RedisSessionStore(SessionStore):
+    """Shared store over the Redis protocol; Redis handles expiry via SET EX"""
+
+    key_prefix = "broker_session:"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(url, decode_responses=True)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.key_prefix}{user_id}"
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        raw = await self._client.get(self._key(user_id))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, user_id: int, data: dict, ttl_seconds: float) -> None:
+        await self._client.set(self._key(user_id), json.dumps(data), px=int(ttl_seconds * 1000))
+
+    async def delete(self, user_id: int) -> None:
+        await self._client.delete(self._key(user_id))
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_session_store() -> SessionStore:
+    backend = settings.session_store_backend
+    if backend == "memory":
+        return InMemorySessionStore()
+    if backend == "redis":
+        return RedisSessionStore(settings.redis_url)
+    raise ValueError(f"Unknown session store backend: {backend}")
+
+
+session_store = create_session_store()
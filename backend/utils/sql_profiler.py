@@ -0,0 +1,133 @@
+"""
+Opt-in per-request SQL profiling (SQL_PROFILER_ENABLED)
+
+Builds on the per-request DB accounting in utils.metrics: the metrics
+engine listeners time every statement into the request's RequestDbStats,
+which the MetricsMiddleware keeps per statement when given this profiler.
+Per request this gives statement count, total DB time and the slowest
+statements (sent as a Server-Timing header when SQL_PROFILER_SERVER_TIMING
+is on), logs statements slower than SQL_SLOW_QUERY_MS as they finish, and
+logs statements repeated SQL_REPEAT_THRESHOLD or more times in one request,
+the usual sign of an N+1 query loop. Log lines are single JSON objects;
+bound parameters are never logged, since they can hold password hashes and
+API keys.
+"""
+from typing import List, Optional
+import json
+import logging
+
+from config import settings
+from utils.metrics import RequestDbStats, add_statement_observer, route_template
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_PREVIEW_CHARS = 200
+
+
+def slowest(stats: RequestDbStats, limit: int) -> List[tuple]:
+    """(statement, slowest execution) pairs, slowest first"""
+    ranked = sorted(stats.statements.items(), key=lambda item: item[1][2], reverse=True)
+    return [(statement, entry[2]) for statement, entry in ranked[:limit]]
+
+
+def repeated(stats: RequestDbStats, threshold: int) -> List[tuple]:
+    """(statement, executions, total seconds) for statements run ``threshold``+ times"""
+    if threshold <= 0:
+        return []
+    return [
+        (statement, entry[0], entry[1])
+        for statement, entry in stats.statements.items() if entry[0] >= threshold
+    ]
+
+
+class SqlProfiler:
+    def __init__(self, slow_query_ms: float, repeat_threshold: int, top_statements: int, server_timing: bool):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.repeat_threshold = repeat_threshold
+        self.top_statements = top_statements
+        self.server_timing = server_timing
+        self.requests = 0
+        self.statements = 0
+        self.slow_queries = 0
+        self.repeated_statements = 0
+
+    def install(self) -> None:
+        """Watch every statement timed by the utils.metrics engine listeners"""
+        add_statement_observer(self._observe)
+
+    def _observe(self, statement: str, elapsed: float, executemany: bool, stats: Optional[RequestDbStats]):
+        self.statements += 1
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries += 1
+            _log({
+                "event": "slow_query",
+                "duration_ms": round(elapsed * 1000, 3),
+                "statement": _preview(statement),
+                "executemany": executemany,
+                **(_request_fields(stats) if stats is not None and stats.scope is not None else {}),
+            })
+
+    def response_headers(self, stats: RequestDbStats) -> list:
+        if not self.server_timing:
+            return []
+        # The endpoint's own queries are done by now; a streaming body's
+        # queries only reach the logs
+        metrics = [f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} queries"']
+        for index, (statement, elapsed) in enumerate(slowest(stats, self.top_statements), 1):
+            metrics.append(f'db-{index};dur={elapsed * 1000:.2f};desc="{_header_text(statement)}"')
+        for statement, executions, _ in repeated(stats, self.repeat_threshold):
+            metrics.append(f'db-repeated;desc="{executions}x {_header_text(statement)}"')
+        return [(b"server-timing", ", ".join(metrics).encode())]
+
+    def finish(self, stats: RequestDbStats) -> None:
+        self.requests += 1
+        for statement, executions, seconds in repeated(stats, self.repeat_threshold):
+            self.repeated_statements += 1
+            _log({
+                "event": "repeated_query",
+                "executions": executions,
+                "total_ms": round(seconds * 1000, 3),
+                "statement": _preview(statement),
+                **_request_fields(stats),
+                "request_queries": stats.count,
+            })
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "statements": self.statements,
+            "slow_queries": self.slow_queries,
+            "repeated_statements": self.repeated_statements,
+            "slow_query_ms": self.slow_query_seconds * 1000,
+            "repeat_threshold": self.repeat_threshold,
+        }
+
+
+def _request_fields(stats: RequestDbStats) -> dict:
+    scope = stats.scope
+    return {"method": scope["method"], "path": scope["path"], "route": route_template(scope)}
+
+
+def _preview(statement: str) -> str:
+    statement = " ".join(statement.split())
+    if len(statement) > STATEMENT_PREVIEW_CHARS:
+        return statement[:STATEMENT_PREVIEW_CHARS] + "..."
+    return statement
+
+
+def _header_text(statement: str) -> str:
+    # Server-Timing desc is a quoted-string; keep it short and ASCII
+    text = _preview(statement)[:80].replace("\\", "").replace('"', "'")
+    return text.encode("ascii", "replace").decode()
+
+
+def _log(record: dict) -> None:
+    logger.warning(json.dumps(record))
+
+
+sql_profiler = SqlProfiler(
+    slow_query_ms=settings.sql_slow_query_ms,
+    repeat_threshold=settings.sql_repeat_threshold,
+    top_statements=settings.sql_profiler_top_statements,
+    server_timing=settings.sql_profiler_server_timing,
+)
@@ -0,0 +1,110 @@
+from threading import Lock
+from typing import Optional
+import time
+
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import User
+
+# Columns whose changes affect the admin counters
+COUNTED_ATTRIBUTES = ("role", "is_active")
+_DIRTY_FLAG = "user_stats_dirty"
+
+
+class UserStatsCache:
+    """Counter cache for the admin dashboard statistics.
+
+    Committed inserts, deletes and role/is_active changes made through the
+    ORM invalidate it; ``ttl_seconds`` bounds staleness from writes made by
+    other workers or bulk statements that bypass the ORM.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._stats: Optional[dict] = None
+        self._expires_at = 0.0
+        self._lock = Lock()
+        self.hits = 0
+        self.recounts = 0
+
+    def get(self) -> Optional[dict]:
+        with self._lock:
+            if self._stats is None or self._expires_at <= time.monotonic():
+                return None
+            self.hits += 1
+            return dict(self._stats)
+
+    def set(self, stats: dict) -> None:
+        with self._lock:
+            self._stats = dict(stats)
+            self._expires_at = time.monotonic() + self.ttl_seconds
+            self.recounts += 1
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._stats = None
+
+
+def count_users(db: Session) -> dict:
+    """All admin counters in a single aggregate query over ``users``"""
+    def count_where(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    row = db.execute(
+        select(
+            func.count(User.id),
+            count_where(User.is_active == True),
+            count_where(User.role == "admin"),
+            count_where(User.role == "broker"),
+            count_where(User.role == "user"),
+        )
+    ).one()
+    return {
+        "total_users": row[0],
+        "active_users": row[1],
+        "admin_users": row[2],
+        "broker_users": row[3],
+        "regular_users": row[4],
+    }
+
+
+def get_user_stats(db: Session, refresh: bool = False) -> dict:
+    if not refresh:
+        stats = user_stats_cache.get()
+        if stats is not None:
+            return stats
+    stats = count_users(db)
+    user_stats_cache.set(stats)
+    return stats
+
+
+@event.listens_for(Session, "before_flush")
+def _track_counted_changes(session, flush_context, instances):
+    if session.info.get(_DIRTY_FLAG):
+        return
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, User):
+            session.info[_DIRTY_FLAG] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in COUNTED_ATTRIBUTES):
+                session.info[_DIRTY_FLAG] = True
+                return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop(_DIRTY_FLAG, False):
+        user_stats_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop(_DIRTY_FLAG, None)
+
+
+user_stats_cache = UserStatsCache(ttl_seconds=settings.stats_cache_ttl_seconds)
@@ -0,0 +1,173 @@
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+import time
+
+from config import settings
+
+
+class RevocationList(ABC):
+    """Revoked access tokens, checked on every authenticated request.
+
+    Two kinds of entry, both kept only until the tokens they cover would
+    have expired anyway: a single token by ``jti`` (logout), and a per-user
+    cutoff that rejects every token issued before it (deactivation,
+    deletion). Cutoffs are whole seconds like JWT ``iat``, so a token issued
+    in the same second as the cutoff, e.g. right after reactivation, is
+    still accepted.
+    """
+
+    @abstractmethod
+    async def is_revoked(self, jti: Optional[str], user_id: int, issued_at: Optional[float]) -> bool:
+        ...
+
+    @abstractmethod
+    async def revoke(self, jti: str, expires_at: float) -> None:
+        ...
+
+    @abstractmethod
+    async def revoke_users(self, user_ids: Iterable[int]) -> None:
+        """Revoke every token issued so far to each of ``user_ids``"""
+
+    async def revoke_user(self, user_id: int) -> None:
+        await self.revoke_users([user_id])
+
+    @abstractmethod
+    async def restore_users(self, user_ids: Iterable[int]) -> None:
+        """Drop the cutoffs of ``user_ids`` (reactivation)"""
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryRevocationList(RevocationList):
+    """Per-process list: two dict lookups per check, pruned as entries expire"""
+
+    def __init__(self, token_lifetime_seconds: float):
+        self.token_lifetime_seconds = token_lifetime_seconds
+        self._tokens: Dict[str, float] = {}
+        self._user_cutoffs: Dict[int, Tuple[float, float]] = {}
+        self._lock = Lock()
+        self._next_prune = 0.0
+        self.rejected = 0
+
+    def check(self, jti: Optional[str], user_id: int, issued_at: Optional[float]) -> bool:
+        if jti is not None and jti in self._tokens:
+            self.rejected += 1
+            return True
+        cutoff = self._user_cutoffs.get(user_id)
+        # Tokens without iat predate revocation support and count as oldest
+        if cutoff is not None and (issued_at or 0) < cutoff[0]:
+            self.rejected += 1
+            return True
+        return False
+
+    async def is_revoked(self, jti: Optional[str], user_id: int, issued_at: Optional[float]) -> bool:
+        return self.check(jti, user_id, issued_at)
+
+    async def revoke(self, jti: str, expires_at: float) -> None:
+        with self._lock:
+            self._tokens[jti] = expires_at
+            self._maybe_prune()
+
+    async def revoke_users(self, user_ids: Iterable[int]) -> None:
+        now = time.time()
+        cutoff = int(now)
+        with self._lock:
+            for user_id in user_ids:
+                self._user_cutoffs[user_id] = (cutoff, now + self.token_lifetime_seconds)
+            self._maybe_prune()
+
+    async def restore_users(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                self._user_cutoffs.pop(user_id, None)
+
+    def _maybe_prune(self) -> None:
+        # Caller must hold the lock
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + 60
+        for jti in [jti for jti, expires_at in self._tokens.items() if expires_at <= now]:
+            del self._tokens[jti]
+        for user_id in [user_id for user_id, (_, expires_at) in self._user_cutoffs.items() if expires_at <= now]:
+            del self._user_cutoffs[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "revoked_tokens": len(self._tokens),
+            "revoked_users": len(self._user_cutoffs),
+            "rejected": self.rejected,
+        }
+
+
+class RedisRevocationList(RevocationList):
+    """Shared list over the Redis protocol for multi-worker deployments.
+
+    Revocations made by this worker are mirrored locally and take effect
+    without a round trip; others cost one pipelined EXISTS + GET per check.
+    """
+
+    key_prefix = "revoked:"
+
+    def __init__(self, url: str, token_lifetime_seconds: float):
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(url, decode_responses=True)
+        self.token_lifetime_seconds = token_lifetime_seconds
+        self._local = InMemoryRevocationList(token_lifetime_seconds)
+
+    async def is_revoked(self, jti: Optional[str], user_id: int, issued_at: Optional[float]) -> bool:
+        if self._local.check(jti, user_id, issued_at):
+            return True
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.exists(f"{self.key_prefix}jti:{jti}")
+            pipe.get(f"{self.key_prefix}user:{user_id}")
+            token_revoked, cutoff = await pipe.execute()
+        if jti is not None and token_revoked:
+            return True
+        return cutoff is not None and (issued_at or 0) < int(cutoff)
+
+    async def revoke(self, jti: str, expires_at: float) -> None:
+        await self._local.revoke(jti, expires_at)
+        ttl_ms = max(int((expires_at - time.time()) * 1000), 1)
+        await self._client.set(f"{self.key_prefix}jti:{jti}", 1, px=ttl_ms)
+
+    async def revoke_users(self, user_ids: Iterable[int]) -> None:
+        user_ids = list(user_ids)
+        await self._local.revoke_users(user_ids)
+        cutoff = int(time.time())
+        async with self._client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.set(f"{self.key_prefix}user:{user_id}", cutoff, px=int(self.token_lifetime_seconds * 1000))
+            await pipe.execute()
+
+    async def restore_users(self, user_ids: Iterable[int]) -> None:
+        user_ids = list(user_ids)
+        await self._local.restore_users(user_ids)
+        if user_ids:
+            await self._client.delete(*(f"{self.key_prefix}user:{user_id}" for user_id in user_ids))
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    def stats(self) -> dict:
+        return {**self._local.stats(), "backend": "redis"}
+
+
+def create_revocation_list() -> RevocationList:
+    lifetime = settings.access_token_expire_minutes * 60
+    backend = settings.token_revocation_backend
+    if backend == "memory":
+        return InMemoryRevocationList(lifetime)
+    if backend == "redis":
+        return RedisRevocationList(settings.redis_url, lifetime)
+    raise ValueError(f"Unknown token revocation backend: {backend}")
+
+
+revocation_list = create_revocation_list()